@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Grouping of input words into batches for the multi-process modes of
+   the command-line tools (e.g. `g2p_icu.py` and `decomp_simple.py`).
+"""
+from __future__ import unicode_literals, division, print_function #Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+
+def chunked(iterable, n):
+    """Group items from iterable into lists of length n (the last list
+       may be shorter)
+    """
+    chunk = []
+    for e in iterable:
+        chunk.append(e)
+        if len(chunk) == n:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
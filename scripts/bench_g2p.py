@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Throughput and accuracy benchmark of the ICU rule-based G2P
+   (`g2p_icu.py`) against the reference dictionaries in each language
+   directory. Predictions are mapped to the reference phone set
+   (e.g. `phonememap.ipa-nchlt.tsv`) before scoring. Reports
+   words/sec, per-word latency percentiles, peak RSS and word/phone
+   error rates; results can be saved (JSON) and compared with those
+   of an earlier run.
+"""
+from __future__ import unicode_literals, division, print_function #Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import os
+import glob
+import time
+import codecs
+import json
+import resource
+import multiprocessing
+from collections import OrderedDict
+from timeit import default_timer as timer
+
+from g2p_icu import G2P_ICURules
+from phonetok import PhoneTokeniseError
+
+DEF_MAPNAME = "ipa-nchlt"
+FIELDS = ["nwords", "words_per_s", "latency_p50_us", "latency_p99_us", "peak_rss_mb", "wer", "per"]
+
+
+def load_phonemap(fn):
+    phmap = {}
+    with codecs.open(fn, encoding="utf-8") as infh:
+        for line in infh:
+            if line.strip():
+                a, b = line.split()
+                phmap[a] = b
+    return phmap
+
+def load_langdir(langdir, mapname):
+    """Returns phones, rules, phone map and reference pronunciations
+       (word -> list of alternatives) in dictionary order
+    """
+    with codecs.open(os.path.join(langdir, "phonemeset.json"), encoding="utf-8") as infh:
+        phones = list(json.load(infh)["phones"].keys())
+    with codecs.open(os.path.join(langdir, "g2p.translit.txt"), encoding="utf-8") as infh:
+        rules = infh.read()
+    phmap = load_phonemap(os.path.join(langdir, "phonememap.{}.tsv".format(mapname)))
+    refs = OrderedDict()
+    for dictfn in sorted(glob.glob(os.path.join(langdir, "ref", "*", "*.dict"))):
+        with codecs.open(dictfn, encoding="utf-8") as infh:
+            for line in infh:
+                fields = line.split()
+                if fields:
+                    refs.setdefault(fields[0], []).append(fields[1:])
+    return phones, rules, phmap, refs
+
+def edit_distance(a, b):
+    prev = list(range(len(b) + 1))
+    for i, x in enumerate(a, start=1):
+        cur = [i]
+        for j, y in enumerate(b, start=1):
+            cur.append(min(prev[j] + 1, cur[j-1] + 1, prev[j-1] + int(x != y)))
+        prev = cur
+    return prev[-1]
+
+def percentile(sortedvalues, p):
+    return sortedvalues[min(len(sortedvalues) - 1, int(p / 100.0 * len(sortedvalues)))]
+
+def peak_rss_mb():
+    #ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def bench(langdir, mapname, equiv):
+    phones, rules, phmap, refs = load_langdir(langdir, mapname)
+    g2p = G2P_ICURules(phones, rules, cachesize=0)
+
+    latencies = []
+    pronuns = []
+    starttime = time.time()
+    for word in refs:
+        t = timer()
+        try:
+            pronun = g2p.predict_word(word)
+        except PhoneTokeniseError:
+            pronun = []
+        latencies.append(timer() - t)
+        pronuns.append(pronun)
+    totaltime = time.time() - starttime
+    latencies.sort()
+
+    nwrong = 0
+    nphoneerrs = 0
+    nrefphones = 0
+    for pronun, word in zip(pronuns, refs):
+        pronun = [equiv.get(ph, ph) for ph in (phmap.get(ph, ph) for ph in pronun)]
+        alts = [[equiv.get(ph, ph) for ph in alt] for alt in refs[word]]
+        dist, ref = min((edit_distance(pronun, alt), alt) for alt in alts)
+        nwrong += int(dist > 0)
+        nphoneerrs += dist
+        nrefphones += len(ref)
+
+    return OrderedDict([("nwords", len(refs)),
+                        ("words_per_s", len(refs) / totaltime),
+                        ("latency_p50_us", percentile(latencies, 50) * 1e6),
+                        ("latency_p99_us", percentile(latencies, 99) * 1e6),
+                        ("peak_rss_mb", peak_rss_mb()),
+                        ("wer", nwrong / len(refs)),
+                        ("per", nphoneerrs / nrefphones)])
+
+def bench_in_child(langdir, mapname, equiv):
+    """Run bench() in a new process so that peak_rss_mb is the peak of
+       this language only (ru_maxrss is never reset within a process)
+    """
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(bench, (langdir, mapname, equiv))
+    finally:
+        pool.close()
+        pool.join()
+
+def format_value(v):
+    if isinstance(v, float):
+        return "{:.4f}".format(v)
+    return "{}".format(v)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('langdirs', metavar='LANGDIR', type=str, nargs="+", help="Language data directories (e.g. data/zul) containing 'phonemeset.json', 'g2p.translit.txt', a phone map and 'ref/*/*.dict'.")
+    parser.add_argument('--mapname', metavar='MAPNAME', type=str, default=DEF_MAPNAME, help="Phone map from the G2P to the reference phone set ('phonememap.MAPNAME.tsv').")
+    parser.add_argument('--phoneequiv', metavar='EQUIV', type=str, default="", help="Comma-separated reference phones to treat as equal when scoring, e.g. 'I=E,U=O' (Sotho/Tswana vowels not distinguished in NCHLT).")
+    parser.add_argument('--save', metavar='RESULTSFILE', type=str, default=None, help="Save results to a JSON file.")
+    parser.add_argument('--compare', metavar='RESULTSFILE', type=str, default=None, help="Compare results with an earlier saved run.")
+    args = parser.parse_args()
+
+    equiv = dict(e.split("=") for e in args.phoneequiv.split(",") if e)
+    previous = {}
+    if args.compare is not None:
+        with codecs.open(args.compare, encoding="utf-8") as infh:
+            previous = json.load(infh)["results"]
+
+    results = OrderedDict()
+    print("\t".join(["lang"] + FIELDS))
+    for langdir in args.langdirs:
+        lang = os.path.basename(os.path.normpath(langdir))
+        results[lang] = bench_in_child(langdir, args.mapname, equiv)
+        print("\t".join([lang] + [format_value(results[lang][k]) for k in FIELDS]))
+        if lang in previous:
+            print("\t".join(["(prev)"] + [format_value(previous[lang].get(k, "-")) for k in FIELDS]))
+            print("\t".join(["(diff)"] + [format_value(results[lang][k] - previous[lang][k]) if k in previous[lang] else "-" for k in FIELDS]))
+
+    if args.save is not None:
+        with codecs.open(args.save, "w", encoding="utf-8") as outfh:
+            json.dump({"time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                       "args": vars(args),
+                       "results": results}, outfh, indent=1)
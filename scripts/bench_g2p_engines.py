@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compare the ICU (`g2p_icu.py`) and OpenFST (`g2p_fst.py`) G2P
+   engines on the word lists of the reference dictionaries in each
+   language directory: reports compilation time, throughput and the
+   number of words on which the predictions differ (tab-separated on
+   STDOUT, differences on STDERR).
+"""
+from __future__ import unicode_literals, division, print_function #Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import os
+import sys
+import glob
+import time
+import codecs
+import json
+
+from g2p_icu import G2P_ICURules
+from g2p_fst import G2P_FST, DEF_BATCHSIZE
+from phonetok import PhoneTokeniseError
+
+FIELDS = ["lang", "nwords", "icu_compile_s", "icu_words_per_s", "fst_compile_s", "fst_nstates", "fst_words_per_s", "ndiffs"]
+
+
+def load_langdir(langdir):
+    with codecs.open(os.path.join(langdir, "phonemeset.json"), encoding="utf-8") as infh:
+        phones = list(json.load(infh)["phones"].keys())
+    with codecs.open(os.path.join(langdir, "g2p.translit.txt"), encoding="utf-8") as infh:
+        rules = infh.read()
+    words = []
+    for dictfn in sorted(glob.glob(os.path.join(langdir, "ref", "*", "*.dict"))):
+        with codecs.open(dictfn, encoding="utf-8") as infh:
+            words.extend(line.split()[0] for line in infh if line.strip())
+    return phones, rules, words
+
+def predict_icu(g2p, words):
+    pronuns = []
+    for word in words:
+        try:
+            pronuns.append(g2p.predict_word(word))
+        except PhoneTokeniseError:
+            pronuns.append(None)
+    return pronuns
+
+def predict_fst(g2p, words, batchsize):
+    pronuns = []
+    for i in range(0, len(words), batchsize):
+        pronuns.extend(g2p.predict_words(words[i:i+batchsize]))
+    return pronuns
+
+def bench(langdir, batchsize):
+    phones, rules, words = load_langdir(langdir)
+    result = {"lang": os.path.basename(os.path.normpath(langdir)), "nwords": len(words)}
+
+    starttime = time.time()
+    icu_g2p = G2P_ICURules(phones, rules, cachesize=0)
+    result["icu_compile_s"] = time.time() - starttime
+    starttime = time.time()
+    icu_pronuns = predict_icu(icu_g2p, words)
+    result["icu_words_per_s"] = len(words) / (time.time() - starttime)
+
+    starttime = time.time()
+    fst_g2p = G2P_FST(phones, rules, alphabet=set("".join(words)))
+    result["fst_compile_s"] = time.time() - starttime
+    result["fst_nstates"] = fst_g2p.fst.num_states()
+    starttime = time.time()
+    fst_pronuns = predict_fst(fst_g2p, words, batchsize)
+    result["fst_words_per_s"] = len(words) / (time.time() - starttime)
+
+    diffs = [(w, a, b) for w, a, b in zip(words, icu_pronuns, fst_pronuns) if a != b]
+    result["ndiffs"] = len(diffs)
+    return result, diffs
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('langdirs', metavar='LANGDIR', type=str, nargs="+", help="Language data directories (e.g. data/zul) containing 'phonemeset.json', 'g2p.translit.txt' and 'ref/*/*.dict'.")
+    parser.add_argument('--batchsize', metavar='BATCHSIZE', type=int, default=DEF_BATCHSIZE, help="Number of words composed with the transducer at a time.")
+    args = parser.parse_args()
+
+    print("\t".join(FIELDS))
+    for langdir in args.langdirs:
+        result, diffs = bench(langdir, args.batchsize)
+        for word, a, b in diffs:
+            print("DIFF ({}): {}\t{}\t{}".format(result["lang"], word, a and " ".join(a), b and " ".join(b)).encode("utf-8"), file=sys.stderr)
+        print("\t".join("{:.3f}".format(result[k]) if isinstance(result[k], float) else str(result[k]) for k in FIELDS))
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark of the DCG morphological analyser (`morph_dcg.py`):
+   time to compile the grammar and to serialise (pickle) the compiled
+   analyser, with FSTs serialised in memory or through temporary
+   files (tab-separated on STDOUT). Given a word list, also compares
+   the size and parsing time of the fully expanded transducers with
+   on-the-fly expansion of the grammar network (which should return
+   the same parses, also when limited to the first MAXPARSES), and can
+   report the size of each compiled FST as a mutable (vector) FST and
+   in the immutable representations, serialised and resident in
+   memory.
+"""
+from __future__ import unicode_literals, division, print_function #Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import sys
+import codecs
+import json
+import pickle
+import resource
+import multiprocessing
+import pywrapfst as wfst
+from collections import OrderedDict
+from timeit import default_timer as timer
+
+from morph_dcg import Morphparse_DCG, Morphparse_RTN, load_simpledcg, fst_to_bytes, fst_from_bytes, fst_size
+
+DEF_REPEAT = 20
+FIELDS = ["npos", "compile_s", "pickle_kb", "pickle_ms", "unpickle_ms",
+          "fsts_to_bytes_ms", "fsts_from_bytes_ms", "fsts_to_bytes_tmpfile_ms", "fsts_from_bytes_tmpfile_ms"]
+FSTTYPES = ["vector", "const", "compact_unweighted"]
+SIZE_FIELDS = ["fst", "states", "arcs"] + [t + "_kb" for t in FSTTYPES] + [t + "_rss_kb" for t in FSTTYPES]
+DEF_NCOPIES = 200
+MODE_FIELDS = ["mode", "compile_s", "states", "arcs", "pickle_kb", "parse_ms_per_word", "nparses", "ndiffs"]
+
+
+def mean_ms(f, repeat):
+    starttime = timer()
+    for i in range(repeat):
+        result = f()
+    return (timer() - starttime) / repeat * 1000.0, result
+
+def bench(descr, dcg, repeat):
+    starttime = timer()
+    morphparse = Morphparse_DCG(dcg, descr)
+    result = OrderedDict([("npos", len(morphparse.fsts)),
+                          ("compile_s", timer() - starttime)])
+
+    result["pickle_ms"], s = mean_ms(lambda: pickle.dumps(morphparse, pickle.HIGHEST_PROTOCOL), repeat)
+    result["pickle_kb"] = len(s) / 1024.0
+    result["unpickle_ms"], _ = mean_ms(lambda: pickle.loads(s), repeat)
+
+    fsts = morphparse.fsts
+    for tmpfile, suffix in [(False, ""), (True, "_tmpfile")]:
+        result["fsts_to_bytes" + suffix + "_ms"], serialised = mean_ms(
+            lambda: dict((pos, fst_to_bytes(fst, tmpfile=tmpfile)) for pos, fst in fsts.iteritems()), repeat)
+        result["fsts_from_bytes" + suffix + "_ms"], _ = mean_ms(
+            lambda: dict((pos, fst_from_bytes(s, tmpfile=tmpfile)) for pos, s in serialised.iteritems()), repeat)
+    return result
+
+def bench_modes(descr, dcg, words, max_parses=None):
+    """Size of what is kept in memory (states/arcs and pickled size)
+       and parsing time for the expanded and on-the-fly analysers, and
+       the words for which the parses (up to _max_parses_) differ from
+       those of the expanded analyser, as (word, expanded, on-the-fly)
+    """
+    results = []
+    diffs = []
+    refparses = None
+    for mode, make in [("expanded", Morphparse_DCG), ("lazy", Morphparse_RTN)]:
+        starttime = timer()
+        morphparse = make(dcg, descr)
+        result = OrderedDict([("mode", mode), ("compile_s", timer() - starttime)])
+        if mode == "expanded":
+            sizes = [fst_size(fst) for fsts in [morphparse.fsts, morphparse.simplefsts] for fst in fsts.values()]
+            result["states"] = sum(e[0] for e in sizes)
+            result["arcs"] = sum(e[1] for e in sizes)
+        else:
+            result["states"], result["arcs"] = morphparse.size()
+        result["pickle_kb"] = len(pickle.dumps(morphparse, pickle.HIGHEST_PROTOCOL)) / 1024.0
+        starttime = timer()
+        parses = [morphparse.parse(word, max_parses=max_parses) for word in words]
+        result["parse_ms_per_word"] = (timer() - starttime) / len(words) * 1000.0
+        result["nparses"] = sum(len(p) for p in parses)
+        if refparses is None:
+            refparses = parses
+        else:
+            diffs.extend((w, a, b) for w, a, b in zip(words, refparses, parses) if a != b)
+        result["ndiffs"] = sum(a != b for a, b in zip(refparses, parses))
+        results.append(result)
+    return results, diffs
+
+def rss_kb():
+    """Resident set size of this process (Linux only)"""
+    with open("/proc/self/statm") as infh:
+        return int(infh.read().split()[1]) * resource.getpagesize() / 1024.0
+
+def _loaded_kb(serialisedfst, ncopies):
+    before = rss_kb()
+    fsts = [fst_from_bytes(serialisedfst) for i in range(ncopies)]
+    return (rss_kb() - before) / len(fsts)
+
+def loaded_kb(serialisedfst, ncopies=DEF_NCOPIES):
+    """Growth in resident memory per FST when _ncopies_ are read from
+       _serialisedfst_ (OpenFST allocations are not seen by Python's
+       memory tracing), measured in a new process each time so that
+       memory freed by earlier measurements is not reused
+    """
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(_loaded_kb, (serialisedfst, ncopies))
+    finally:
+        pool.close()
+        pool.join()
+
+def fst_sizes(descr, dcg, ncopies=DEF_NCOPIES):
+    """Serialised and resident size of each compiled FST as each of
+       FSTTYPES or None where the FST cannot be converted (compact types
+       for weighted FSTs)
+    """
+    morphparse = Morphparse_DCG(dcg, descr)
+    results = []
+    for name, fsts in [("", morphparse.fsts), (".simple", morphparse.simplefsts)]:
+        for pos in sorted(fsts):
+            result = OrderedDict([("fst", pos + name)])
+            result["states"], result["arcs"] = fst_size(fsts[pos])
+            for fsttype in FSTTYPES:
+                try:
+                    serialisedfst = fst_to_bytes(wfst.convert(fsts[pos], fsttype))
+                except wfst.FstOpError:
+                    result[fsttype + "_kb"] = result[fsttype + "_rss_kb"] = None
+                    continue
+                result[fsttype + "_kb"] = len(serialisedfst) / 1024.0
+                result[fsttype + "_rss_kb"] = loaded_kb(serialisedfst, ncopies)
+            results.append(result)
+    return results
+
+def format_value(v):
+    if isinstance(v, float):
+        return "{:.4f}".format(v)
+    if v is None:
+        return "-"
+    return "{}".format(v)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('descrfn', metavar='DESCRFN', type=str, help="JSON file containing a description of how to interpret the DCG file (e.g. graphemes and POS categories etc.)")
+    parser.add_argument('dcgfn', metavar='DCGFN', type=str, help="input DCG filename")
+    parser.add_argument('--words', metavar='WORDSFILE', type=str, default=None, help="Also compare the expanded and on-the-fly analysers parsing these words (one per line).")
+    parser.add_argument('--maxparses', metavar='MAXPARSES', type=int, default=None, help="Compare only the first MAXPARSES parses of each word (with --words).")
+    parser.add_argument('--fstsizes', action='store_true', help="Also report the size of each compiled FST in each representation.")
+    parser.add_argument('--ncopies', metavar='NCOPIES', type=int, default=DEF_NCOPIES, help="Number of copies of each FST loaded to measure its resident size (with --fstsizes).")
+    parser.add_argument('--repeat', metavar='REPEAT', type=int, default=DEF_REPEAT, help="Number of times each (de)serialisation is timed.")
+    args = parser.parse_args()
+
+    with codecs.open(args.descrfn, encoding="utf-8") as infh:
+        descr = json.load(infh)
+    with codecs.open(args.dcgfn, encoding="utf-8") as infh:
+        dcg = load_simpledcg(infh.read())
+
+    result = bench(descr, dcg, args.repeat)
+    print("\t".join(FIELDS))
+    print("\t".join(format_value(result[k]) for k in FIELDS))
+
+    if args.fstsizes:
+        print()
+        print("\t".join(SIZE_FIELDS))
+        for result in fst_sizes(descr, dcg, args.ncopies):
+            print("\t".join(format_value(result[k]) for k in SIZE_FIELDS))
+
+    if args.words is not None:
+        with codecs.open(args.words, encoding="utf-8") as infh:
+            words = [line.split()[0] for line in infh if line.strip()]
+        print()
+        print("\t".join(MODE_FIELDS))
+        results, diffs = bench_modes(descr, dcg, words, args.maxparses)
+        for word, a, b in diffs:
+            print("DIFF: {}\t{}\t{}".format(word, " ".join(a), " ".join(b)).encode("utf-8"), file=sys.stderr)
+        for result in results:
+            print("\t".join(format_value(result[k]) for k in MODE_FIELDS))
@@ -7,10 +7,22 @@ from __future__ import unicode_literals, division, print_function #Py2
 __author__ = "Daniel van Niekerk"
 __email__ = "dvn.demitasse@gmail.com"
 
+import os
 import itertools
+import heapq
+from collections import OrderedDict
+from timeit import default_timer as timer
 
 import pywrapfst as wfst # Install OpenFST 1.5.4 or later and build with Python bindings
 
+from wordstore import WordStore, load_words
+from batching import chunked
+
+DEF_ENGINE = "fst"
+DEF_MEMOSIZE = 100000
+DEF_MINPARTLEN = 1
+NO_LIMITS = frozenset()
+
 
 def is_final(fst, state):
     return fst.final(state) != wfst.Weight.Zero(fst.weight_type())
@@ -95,9 +107,98 @@ def test_tree():
     my_tree.insert("Steven")
 
 
-class SimpleDecompounder(Decompounder):
+class WordIndex(object):
+    """Word list (a set) answering the split point queries of the
+       decompounder (as wordstore.WordStore does for a memory-mapped
+       word list)
+    """
     def __init__(self, wordlist):
         self.words = set(wordlist)
+
+    def split_matches(self, word, maxlen=None):
+        """(i, number of word[:i] and word[i:] in the word list) for the
+           positions 0 <= i < len(word) with at least one, parts longer
+           than _maxlen_ are not looked up
+        """
+        words = self.words
+        n = len(word)
+        prefixmax = n if maxlen is None else maxlen
+        suffixmin = 0 if maxlen is None else n - maxlen
+        matches = []
+        for i in range(n):
+            m = (i <= prefixmax and word[:i] in words) + (i >= suffixmin and word[i:] in words)
+            if m:
+                matches.append((i, m))
+        return matches
+
+    def __contains__(self, word):
+        return word in self.words
+
+    def __iter__(self):
+        return iter(self.words)
+
+    def __len__(self):
+        return len(self.words)
+
+
+class BudgetExceeded(Exception):
+    """Raised (and handled in the decompounder) when the work on a
+       word exceeds the operation or time budget, args[0] names the
+       limit
+    """
+    pass
+
+
+class SimpleDecompounder(Decompounder):
+    """Recursively split words at the best candidate point and find the
+       cheapest segmentation over the resulting split tree, either by
+       building a lattice and running OpenFST shortest path ("fst") or
+       with an equivalent dynamic program in Python ("dp") which also
+       memoises the segmentation of substrings across words
+    """
+    ENGINES = ["fst", "dp"]
+    LIMITS = ["minpartlen", "maxpartlen", "maxdepth", "maxops", "maxtime"]
+
+    def __init__(self, wordlist, engine=DEF_ENGINE, memosize=DEF_MEMOSIZE,
+                 minpartlen=DEF_MINPARTLEN, maxpartlen=None, maxdepth=None, maxops=None, maxtime=None):
+        """_wordlist_ is a sequence of words or a (memory-mapped)
+           wordstore.WordStore
+
+           Limits (None for no limit) bound the work on long inputs:
+             - minpartlen: shortest part considered when splitting
+             - maxpartlen: longest part looked up in the word list
+             - maxdepth: deepest level of the split tree split further
+             - maxops, maxtime: number of split decisions (nodes in the
+               split tree) and seconds per word, if exceeded the word
+               is left unsplit
+        """
+        if engine not in self.ENGINES:
+            raise ValueError("Unknown decompounding engine: {}".format(engine))
+        if isinstance(wordlist, (WordIndex, WordStore)):
+            self.words = wordlist
+        else:
+            self.words = WordIndex(wordlist)
+        self.engine = engine
+        self.memosize = memosize
+        self.minpartlen = minpartlen
+        self.maxpartlen = maxpartlen
+        self.maxdepth = maxdepth
+        self.maxops = maxops
+        self.maxtime = maxtime
+        self._init_memo()
+        #number of words for which each limit was applied
+        self.limitcounts = dict((limit, 0) for limit in self.LIMITS)
+        self._startword()
+
+    def _init_memo(self):
+        """LRU memo shared across words ("dp" engine): best segmentation
+           of substrings below the root of the split tree (substring ->
+           as returned by _bestseg()), the most recently used entry is
+           kept at the end
+        """
+        self.memo = OrderedDict()
+        self.memohits = 0
+        self.memomisses = 0
         
     def _to_split_or_not(self, splitcand):
         if len(splitcand) == 2: #split proposed?
@@ -109,29 +210,79 @@ class SimpleDecompounder(Decompounder):
             w = splitcand
         return w
         
-    def _split(self, word, rootnode):
+    def _startword(self):
+        self._ops = 0
+        self._applied = set()
+        if self.maxtime is not None:
+            self._deadline = timer() + self.maxtime
+
+    def _spend(self, n=1):
+        self._ops += n
+        if self.maxops is not None and self._ops > self.maxops:
+            raise BudgetExceeded("maxops")
+        if self.maxtime is not None and timer() > self._deadline:
+            raise BudgetExceeded("maxtime")
+
+    def _countlimits(self):
+        for limit in self._applied:
+            self.limitcounts[limit] += 1
+
+    def limitstats(self):
+        """Number of words for which each limit was applied: minpartlen
+           and maxdepth when they changed a split decision, maxpartlen
+           when it cut the lookups short, maxops and maxtime when they
+           left the word unsplit
+        """
+        return dict(self.limitcounts)
+
+    @staticmethod
+    def _pickbest(word, matches, minpartlen):
+        """Split point with the most known parts, nearest the center
+           (then leftmost), of parts at least _minpartlen_ long
+        """
         center = len(word) / 2.0
-        scores = []
-        for i in range(len(word)):
-            w1, w2 = word[:i], word[i:]
-            matches = int(w1 in self.words) + int(w2 in self.words)
-            if matches:
-                #print(w1, w2, [i, matches, abs(i - center)])
-                scores.append([i, matches, abs(i - center)])
+        scores = [(-m, abs(i - center), i) for i, m in matches
+                  if i == 0 or min(i, len(word) - i) >= minpartlen]
         if not scores: #early stop if no good candidates
-            return [word]
-        scores.sort(key=lambda x:x[2])
-        scores.sort(key=lambda x:x[1], reverse=True)
-        bestidx = scores[0][0]
+            return 0
+        return min(scores)[2]
+
+    def _bestsplit(self, word, depth=0):
+        """Best split point of _word_ at _depth_ in the split tree (0 if
+           it should not be split) and the limits applied
+        """
+        self._spend()
+        #split points where word[:i] and/or word[i:] are known words
+        #(parts longer than maxpartlen are not looked up)
+        matches = self.words.split_matches(word, self.maxpartlen)
+        bestidx = self._pickbest(word, matches, DEF_MINPARTLEN)
+        if self.maxpartlen is None and self.minpartlen <= DEF_MINPARTLEN and self.maxdepth is None:
+            return bestidx, NO_LIMITS
+        limits = []
+        if self.maxpartlen is not None and len(word) > self.maxpartlen:
+            limits.append("maxpartlen")
+        if self.minpartlen > DEF_MINPARTLEN:
+            idx = self._pickbest(word, matches, self.minpartlen)
+            if idx != bestidx:
+                limits.append("minpartlen")
+                bestidx = idx
+        if bestidx != 0 and self.maxdepth is not None and depth >= self.maxdepth:
+            limits.append("maxdepth")
+            bestidx = 0
+        return bestidx, frozenset(limits)
+
+    def _split(self, word, rootnode, depth=0):
+        bestidx, limits = self._bestsplit(word, depth)
+        self._applied.update(limits)
         if bestidx == 0:
             return [word]
         else:
             #print("trying:", word[:bestidx], word[bestidx:])
             left = rootnode.insert(word[:bestidx])
-            self._split(word[:bestidx], left)
+            self._split(word[:bestidx], left, depth + 1)
             #print(cand1, len(cand1))
             right = rootnode.insert(word[bestidx:])
-            self._split(word[bestidx:], right)
+            self._split(word[bestidx:], right, depth + 1)
 
     def wordcost(self, word, firstword):
         if firstword:
@@ -141,6 +292,72 @@ class SimpleDecompounder(Decompounder):
         return 1.0
 
     def decompound(self, word):
+        self._startword()
+        try:
+            if self.engine == "dp":
+                parts = self._decompound_dp(word)
+            else:
+                parts = self._decompound_fst(word)
+        except BudgetExceeded as e:
+            self.limitcounts[e.args[0]] += 1
+            return [word]
+        self._countlimits()
+        return parts
+
+    def _bestseg(self, word, firstword=False, depth=0):
+        """Cheapest segmentation (cost, tuple of parts, number of nodes,
+           limits applied) of the subtree rooted at _word_: the lattice
+           arcs of a subtree
+           only span positions inside it, so this is the node itself or
+           the best segmentations of its two children concatenated. On
+           ties the unsplit node is kept (as OpenFST shortest path does
+           on the lattice)
+        """
+        cost, parts, nnodes = self.wordcost(word, firstword), (word,), 1
+        bestidx, limits = self._bestsplit(word, depth)
+        if bestidx != 0:
+            leftcost, leftparts, leftnodes, leftlimits = self._memoseg(word[:bestidx], depth + 1)
+            rightcost, rightparts, rightnodes, rightlimits = self._memoseg(word[bestidx:], depth + 1)
+            if leftcost + rightcost < cost:
+                cost, parts = leftcost + rightcost, leftparts + rightparts
+            nnodes += leftnodes + rightnodes
+            if leftlimits or rightlimits:
+                limits = limits.union(leftlimits, rightlimits)
+        return cost, parts, nnodes, limits
+
+    def _memoseg(self, word, depth):
+        if self.memosize <= 0:
+            return self._bestseg(word, depth=depth)
+        #with a depth limit the subtree also depends on the depth
+        key = word if self.maxdepth is None else (word, depth)
+        seg = self.memo.get(key)
+        if seg is not None:
+            self.memohits += 1
+            #the budget counts the nodes of the whole split tree (spent
+            #before the entry is moved to the end so that it is kept if
+            #the budget is exceeded)
+            self._spend(seg[2])
+            del self.memo[key]
+        else:
+            self.memomisses += 1
+            seg = self._bestseg(word, depth=depth)
+            if len(self.memo) >= self.memosize:
+                self.memo.popitem(last=False)
+        self.memo[key] = seg
+        return seg
+
+    def memostats(self):
+        return {"size": len(self.memo),
+                "capacity": self.memosize,
+                "hits": self.memohits,
+                "misses": self.memomisses}
+
+    def _decompound_dp(self, word):
+        cost, parts, nnodes, limits = self._bestseg(word, firstword=True)
+        self._applied.update(limits)
+        return list(parts)
+
+    def _decompound_fst(self, word):
         tree = Tree(word)
         self._split(word, tree)
         #print(tree)
@@ -166,6 +383,62 @@ class SimpleDecompounder(Decompounder):
         wordseq = label_seq(best, symtablel)
         return wordseq
 
+    def _lattice(self, word, start=0, arcs=None, depth=0):
+        """Arcs (start -> [(end, cost)]) of the lattice over the split
+           tree of _word_ (as built by Tree.makelattice)
+        """
+        firstword = arcs is None
+        if firstword:
+            arcs = {}
+        arcs.setdefault(start, []).append((start + len(word), self.wordcost(word, firstword)))
+        bestidx, limits = self._bestsplit(word, depth)
+        self._applied.update(limits)
+        if bestidx != 0:
+            self._lattice(word[:bestidx], start, arcs, depth + 1)
+            self._lattice(word[bestidx:], start + bestidx, arcs, depth + 1)
+        return arcs
+
+    def nbest(self, word):
+        """Lazily yield (cost, parts) for all segmentations of _word_ in
+           its lattice, cheapest first (the first is the best path as
+           returned by the engines): A* search with the exact cheapest
+           cost from each position to the end as heuristic
+        """
+        if not word:
+            yield self.wordcost(word, firstword=True), [word]
+            return
+        self._startword()
+        try:
+            arcs = self._lattice(word)
+        except BudgetExceeded as e:
+            self.limitcounts[e.args[0]] += 1
+            yield self.wordcost(word, firstword=True), [word]
+            return
+        self._countlimits()
+        togo = {len(word): 0.0}
+        for start in sorted(arcs, reverse=True):
+            togo[start] = min(cost + togo[end] for end, cost in arcs[start])
+        #best path with ties broken towards the outermost (longest) arc
+        bestparts = []
+        pos = 0
+        while pos != len(word):
+            end = max(end for end, cost in arcs[pos] if cost + togo[end] == togo[pos])
+            bestparts.append(word[pos:end])
+            pos = end
+        bestparts = tuple(bestparts)
+        yield togo[0], list(bestparts)
+        #(estimated total cost, insertion count for stable ties, position, cost so far, parts)
+        count = itertools.count()
+        heap = [(togo[0], next(count), 0, 0.0, ())]
+        while heap:
+            _, _, pos, cost, parts = heapq.heappop(heap)
+            if pos == len(word):
+                if parts != bestparts:
+                    yield cost, list(parts)
+                continue
+            for end, arccost in arcs[pos]:
+                heapq.heappush(heap, (cost + arccost + togo[end], next(count), end, cost + arccost, parts + (word[pos:end],)))
+
 
 class SyllabDecompounder(SimpleDecompounder):
     """Run basic decompound but post-process output so that any unknown
@@ -173,7 +446,20 @@ class SyllabDecompounder(SimpleDecompounder):
        attach interfix -s- to the previous token)
     """
     def decompound(self, word):
-        splitform = super(SyllabDecompounder, self).decompound(word)
+        return self._attach_unknown(super(SyllabDecompounder, self).decompound(word))
+
+    def nbest(self, word):
+        """As SimpleDecompounder.nbest but with unknown tokens re-attached
+           (segmentations which become identical are only yielded once)
+        """
+        seen = set()
+        for cost, splitform in super(SyllabDecompounder, self).nbest(word):
+            splitform = self._attach_unknown(splitform)
+            if tuple(splitform) not in seen:
+                seen.add(tuple(splitform))
+                yield cost, splitform
+
+    def _attach_unknown(self, splitform):
         if len(splitform) == 1:
             return splitform
         newsplitform = []
@@ -188,6 +474,26 @@ class SyllabDecompounder(SimpleDecompounder):
         return newsplitform
 
 
+def _init_worker(decomp, nbest):
+    """Each worker process receives the decompounder (and word list)
+       once: inherited when the pool forks, or as the file name of a
+       WordStore which is memory-mapped
+    """
+    global _worker_decomp, _worker_nbest
+    _worker_decomp = decomp
+    _worker_nbest = nbest
+
+def _decompound_words(words):
+    """Returns (word, parts) or with nbest (word, [(cost, parts), ...])
+       for _words_ and (process id, memo statistics, limit statistics)
+       of the worker
+    """
+    if _worker_nbest > 0:
+        results = [(word, list(itertools.islice(_worker_decomp.nbest(word), _worker_nbest))) for word in words]
+    else:
+        results = [(word, _worker_decomp(word)) for word in words]
+    return results, (os.getpid(), _worker_decomp.memostats(), _worker_decomp.limitstats())
+
     
 def test(wordlistfn, compword):
     import codecs
@@ -199,10 +505,58 @@ def test(wordlistfn, compword):
     
 if __name__ == "__main__":
     import sys, codecs
+    import json
+    import argparse
+    import multiprocessing
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('wordlistfile', metavar='WORDLISTFILE', type=str, help="File containing known words (whitespace-separated, utf-8) or a word store built with 'wordstore.py'.")
+    parser.add_argument('--engine', metavar='ENGINE', type=str, default=DEF_ENGINE, choices=SimpleDecompounder.ENGINES, help="Segmentation engine (fst|dp): OpenFST shortest path over a lattice per word, or an equivalent dynamic program in Python.")
+    parser.add_argument('--nbest', metavar='N', type=int, default=0, help="Output up to N best segmentations per word with their costs (in OUTPUTFORMAT) instead of only the best segmentation.")
+    parser.add_argument('--oformat', metavar='OUTPUTFORMAT', type=str, default="tsv", choices=["tsv", "json"], help="Output format for --nbest (tsv|json): 'word rank cost segmentation' tab-separated or JSON lines.")
+    parser.add_argument('--memosize', metavar='MEMOSIZE', type=int, default=DEF_MEMOSIZE, help="Maximum number of substring segmentations kept in the LRU memo of the 'dp' engine (0 disables the memo).")
+    parser.add_argument('--minpartlen', metavar='MINPARTLEN', type=int, default=DEF_MINPARTLEN, help="Shortest part (in characters) considered when splitting.")
+    parser.add_argument('--maxpartlen', metavar='MAXPARTLEN', type=int, default=None, help="Longest part (in characters) looked up in the word list.")
+    parser.add_argument('--maxdepth', metavar='MAXDEPTH', type=int, default=None, help="Maximum recursion depth of splitting.")
+    parser.add_argument('--maxops', metavar='MAXOPS', type=int, default=None, help="Maximum number of split decisions per word, words exceeding this are left unsplit.")
+    parser.add_argument('--maxtime', metavar='MAXTIME', type=float, default=None, help="Maximum time (seconds) per word, words exceeding this are left unsplit.")
+    parser.add_argument('--jobs', metavar='JOBS', type=int, default=1, help="Number of worker processes.")
+    parser.add_argument('--chunksize', metavar='CHUNKSIZE', type=int, default=1000, help="Number of words sent to a worker process at a time.")
+    args = parser.parse_args()
 
-    with codecs.open(sys.argv[1], encoding="utf-8") as infh:
-        decomp = SimpleDecompounder(infh.read().split())
+    decomp = SimpleDecompounder(load_words(args.wordlistfile), engine=args.engine, memosize=args.memosize,
+                                minpartlen=args.minpartlen, maxpartlen=args.maxpartlen, maxdepth=args.maxdepth,
+                                maxops=args.maxops, maxtime=args.maxtime)
 
-    for line in sys.stdin:
-        word = unicode(line.strip(), encoding="utf-8")
-        print("\t".join([word, "-".join(decomp(word))]).encode("utf-8"))
+    words = (unicode(line.strip(), encoding="utf-8") for line in sys.stdin)
+    if args.jobs > 1:
+        #imap returns results in input order
+        pool = multiprocessing.Pool(args.jobs, initializer=_init_worker, initargs=(decomp, args.nbest))
+        results = pool.imap(_decompound_words, chunked(words, args.chunksize))
+    else:
+        _init_worker(decomp, args.nbest)
+        results = (_decompound_words([word]) for word in words)
+    workerstats = {} #latest (cumulative) statistics per process
+    for chunk, (pid, memostats, limitstats) in results:
+        workerstats[pid] = (memostats, limitstats)
+        for word, result in chunk:
+            if args.nbest <= 0:
+                print("\t".join([word, "-".join(result)]).encode("utf-8"))
+                continue
+            for rank, (cost, parts) in enumerate(result, start=1):
+                if args.oformat == "json":
+                    print(json.dumps({"word": word, "rank": rank, "cost": cost, "parts": parts}, ensure_ascii=False).encode("utf-8"))
+                else:
+                    print("\t".join([word, str(rank), str(cost), "-".join(parts)]).encode("utf-8"))
+        if args.nbest > 0:
+            sys.stdout.flush()
+    if args.jobs > 1:
+        pool.close()
+        pool.join()
+    #totals over the worker processes
+    memostats = dict((k, sum(s[0][k] for s in workerstats.values())) for k in ["size", "capacity", "hits", "misses"])
+    limitstats = dict((k, sum(s[1][k] for s in workerstats.values())) for k in SimpleDecompounder.LIMITS)
+    if args.engine == "dp" and args.memosize > 0:
+        print("Memo statistics: {}".format(memostats), file=sys.stderr)
+    if any(limitstats.values()):
+        print("Limits applied: {}".format(limitstats), file=sys.stderr)
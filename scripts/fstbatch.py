@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Processing a batch of words with a single composition: a prefix tree
+   over the words, each followed by a marker label identifying the word,
+   is composed with a transducer extended to pass the markers through
+   (used by `g2p_fst.py` and `morph_dcg.py`).
+"""
+from __future__ import unicode_literals, division, print_function #Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import pywrapfst as wfst # Install OpenFST 1.5.4 or later and build with Python bindings
+
+
+def make_inputtrie(words, stoi, markerbase):
+    """Prefix tree acceptor over _words_, each word followed by an arc
+       labelled with its marker (markerbase + index in _words_), sorted
+       on output labels
+    """
+    one = wfst.Weight.One(wfst.Fst().weight_type())
+    fst = wfst.Fst()
+    root = fst.add_state()
+    fst.set_start(root)
+    children = {}
+    for i, word in enumerate(words):
+        s = root
+        for c in word:
+            try:
+                s = children[(s, c)]
+            except KeyError:
+                t = fst.add_state()
+                fst.add_arc(s, wfst.Arc(stoi[c], stoi[c], one, t))
+                children[(s, c)] = t
+                s = t
+        t = fst.add_state()
+        fst.add_arc(s, wfst.Arc(markerbase + i, markerbase + i, one, t))
+        fst.set_final(t, one)
+    fst.arcsort(sort_type="olabel")
+    return fst
+
+
+def add_markers(fst, markerbase, nmarkers):
+    """Mutable copy of _fst_ which after each accepted string accepts
+       (and outputs) one of _nmarkers_ marker labels starting at
+       _markerbase_, sorted on input labels
+    """
+    zero = wfst.Weight.Zero(fst.weight_type())
+    one = wfst.Weight.One(fst.weight_type())
+    fst = wfst.convert(fst, "vector")
+    hub = fst.add_state()
+    end = fst.add_state()
+    for s in fst.states():
+        if s != hub and s != end and fst.final(s) != zero:
+            fst.add_arc(s, wfst.Arc(0, 0, fst.final(s), hub))
+            fst.set_final(s, zero)
+    for i in range(nmarkers):
+        fst.add_arc(hub, wfst.Arc(markerbase + i, markerbase + i, one, end))
+    fst.set_final(end, one)
+    fst.arcsort(sort_type="ilabel")
+    return fst
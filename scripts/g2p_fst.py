@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""G2P implementation compiling ICU transliteration rules (and phone
+   tokenisation) into a single OpenFST transducer mapping graphemes
+   to phone ids. Predictions are identical to `g2p_icu.py`.
+"""
+from __future__ import unicode_literals, division, print_function #Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import sys
+
+import pywrapfst as wfst # Install OpenFST 1.5.4 or later and build with Python bindings
+
+from icurules import parse_rules, chr_range, RulePhase, CaseMapPhase
+from phonetok import PhoneTokeniser, PhoneTokeniseError, END
+from fstbatch import make_inputtrie, add_markers
+
+DEF_BATCHSIZE = 1000
+
+
+def drain_phones(trie, buf, final):
+    """Greedily take longest-match phones from the start of _buf_ as far
+       as can be decided, returns (phones, remaining buf) or None if
+       _buf_ cannot be decoded
+    """
+    phones = []
+    while buf:
+        node = trie
+        match = None
+        for j, c in enumerate(buf):
+            node = node.get(c)
+            if node is None:
+                break
+            if END in node:
+                match = node[END]
+        else:
+            if not final and len(node) > int(END in node):
+                break #a longer phone may follow
+        if match is None:
+            return None
+        phones.append(match)
+        buf = buf[len(match):]
+    return phones, buf
+
+
+class G2PMachine(object):
+    """Deterministic streaming G2P: the state combines the state of each
+       rule phase and the pending phone tokenisation buffer
+    """
+    def __init__(self, phones, rules):
+        self.phases = parse_rules(rules)
+        self.trie = PhoneTokeniser(phones).trie
+        #characters the rules or phones distinguish from any other
+        self.mentioned = set("".join(phones))
+        for phase in self.phases:
+            if isinstance(phase, RulePhase):
+                for rule in phase.rules:
+                    for chars, negated in rule.ante + rule.key + rule.post:
+                        self.mentioned.update(chars)
+        self.casemaps = [phase.casemap for phase in self.phases if isinstance(phase, CaseMapPhase)]
+        #representative of the rest (from the private use area)
+        self.oovchar = next(c for c in chr_range("\ue000", "\uf8ff") if self.is_oov(c))
+
+    def is_oov(self, c):
+        """Whether _c_ behaves as any other character not mentioned in
+           the rules or phones (also after case mapping), so that a single
+           representative (_oovchar_) can stand in for all of them
+        """
+        if c in self.mentioned:
+            return False
+        for casemap in self.casemaps:
+            c = casemap(c)
+            if len(c) != 1 or c in self.mentioned:
+                return False
+        return True
+
+    def canonical(self, c):
+        """Character with the same effect as _c_ in every state: _oovchar_
+           for characters not distinguished by the rules and phones, the
+           case-mapped character if the rules start with case mapping,
+           else _c_ itself
+        """
+        if self.is_oov(c):
+            return self.oovchar
+        if self.phases and isinstance(self.phases[0], CaseMapPhase):
+            mapped = self.phases[0].casemap(c)
+            if len(mapped) == 1 and self.phases[0].casemap(mapped) == mapped:
+                return mapped
+        return c
+
+    def initial(self):
+        return (tuple(phase.initial() for phase in self.phases), "")
+
+    def step(self, state, c):
+        """Returns (next state, phones) or None if the input cannot be
+           tokenised into phones
+        """
+        phasestates, buf = state
+        nextstates = []
+        for phase, phasestate in zip(self.phases, phasestates):
+            phasestate, c = phase.feed(phasestate, c)
+            nextstates.append(phasestate)
+        drained = drain_phones(self.trie, buf + c, final=False)
+        if drained is None:
+            return None
+        phones, buf = drained
+        return (tuple(nextstates), buf), phones
+
+    def finish(self, state):
+        """Returns the phones output at the end of the input or None
+        """
+        phasestates, buf = state
+        out = ""
+        for phase, phasestate in zip(self.phases, phasestates):
+            phasestate, out = phase.feed(phasestate, out)
+            out += phase.flush(phasestate)
+        drained = drain_phones(self.trie, buf + out, final=True)
+        if drained is None:
+            return None
+        return drained[0]
+
+
+def add_path(fst, state, ilabel, olabels, nextstate):
+    """Add arcs from _state_ to _nextstate_ consuming _ilabel_ and
+       emitting one or more _olabels_ (via new intermediate states)
+    """
+    one = wfst.Weight.One(fst.weight_type())
+    olabels = list(olabels) or [0]
+    for olabel in olabels[:-1]:
+        s = fst.add_state()
+        fst.add_arc(state, wfst.Arc(ilabel, olabel, one, s))
+        state, ilabel = s, 0
+    fst.add_arc(state, wfst.Arc(ilabel, olabels[-1], one, nextstate))
+
+
+def add_final(machine, fst, state, s, osyms):
+    """Make _s_ (the state of _fst_ for _state_) final, with an epsilon
+       path over the phones flushed at the end of the word if necessary
+    """
+    one = wfst.Weight.One(fst.weight_type())
+    phones = machine.finish(state)
+    if phones is None:
+        return
+    if phones:
+        f = fst.add_state()
+        add_path(fst, s, 0, [osyms[ph] for ph in phones], f)
+        fst.set_final(f, one)
+    else:
+        fst.set_final(s, one)
+
+
+def expand_g2p(machine, fst, stateids, oldchars, newchars, isyms, osyms):
+    """Add arcs over _newchars_ to the (non-deterministic) transducer
+       _fst_ of the states of _machine_ reachable over _oldchars_, and
+       the states which become reachable (_stateids_ maps machine states
+       to states of _fst_ and is updated)
+    """
+    allchars = list(oldchars) + list(newchars)
+    #(machine state, characters still to be followed from it)
+    queue = [(state, newchars) for state in stateids]
+    if not stateids:
+        start = machine.initial()
+        stateids[start] = fst.add_state()
+        fst.set_start(stateids[start])
+        queue.append((start, allchars))
+        add_final(machine, fst, start, stateids[start], osyms)
+    while queue:
+        state, chars = queue.pop()
+        s = stateids[state]
+        for c in chars:
+            result = machine.step(state, c)
+            if result is None:
+                continue
+            nextstate, phones = result
+            if nextstate not in stateids:
+                stateids[nextstate] = fst.add_state()
+                queue.append((nextstate, allchars))
+                add_final(machine, fst, nextstate, stateids[nextstate], osyms)
+            add_path(fst, s, isyms[c], [osyms[ph] for ph in phones], stateids[nextstate])
+
+
+def optimise_g2p(fst):
+    """Determinised, minimised and input-arcsorted copy of _fst_"""
+    fst = wfst.determinize(fst)
+    fst.minimize()
+    fst.arcsort(sort_type="ilabel")
+    return fst
+
+
+def compile_g2p(machine, alphabet, isyms, osyms):
+    """Enumerate the reachable states of _machine_ over _alphabet_ and
+       build the corresponding (determinised, minimised and
+       input-arcsorted) transducer
+    """
+    fst = wfst.Fst()
+    expand_g2p(machine, fst, {}, [], list(alphabet), isyms, osyms)
+    return optimise_g2p(fst)
+
+
+class G2P_FST(object):
+    """Same interface as g2p_icu.G2P_ICURules, the transducer is
+       compiled for an alphabet which is extended when unseen characters
+       are encountered: the states already explored are only followed
+       over the new characters. Input characters are first mapped to
+       G2PMachine.canonical() characters, so that e.g. upper case and
+       characters not mentioned in the rules do not extend the alphabet.
+    """
+    def __init__(self, phones, rules, alphabet=()):
+        self.phones = sorted(set(phones))
+        self.rules = rules
+        self.machine = G2PMachine(self.phones, self.rules)
+        self.osyms = dict((ph, i+1) for i, ph in enumerate(self.phones))
+        self.itos = dict((i, ph) for ph, i in self.osyms.items())
+        self.alphabet = []
+        self.isyms = {}
+        self.charmap = {} #input character -> canonical character
+        self.rawfst = wfst.Fst()
+        self.stateids = {}
+        self.compile(set(alphabet).union([self.machine.oovchar]))
+
+    def compile(self, alphabet):
+        """Extend the transducer with the characters in _alphabet_ (all
+           in one pass)
+        """
+        for c in set(alphabet).difference(self.charmap):
+            self.charmap[c] = self.machine.canonical(c)
+        newchars = sorted(set(self.charmap[c] for c in alphabet).difference(self.isyms))
+        if not newchars and self.stateids:
+            return
+        for c in newchars:
+            self.isyms[c] = len(self.isyms) + 1
+        expand_g2p(self.machine, self.rawfst, self.stateids, self.alphabet, newchars, self.isyms, self.osyms)
+        self.alphabet.extend(newchars)
+        self.fst = optimise_g2p(self.rawfst)
+        #word-final markers (for batches) have labels above all symbols
+        self.markerbase = max(len(self.isyms), len(self.osyms)) + 1
+
+    def _mapword(self, word):
+        return "".join(self.charmap[c] for c in word)
+
+    def predict_words(self, words):
+        """Predict a batch of words with a single composition, returns a
+           list of phone lists (None where the output cannot be tokenised
+           into phones)
+        """
+        words = list(words)
+        self.compile(set("".join(words)))
+        uniqwords = sorted(set(words))
+        ifst = make_inputtrie([self._mapword(word) for word in uniqwords], self.isyms, self.markerbase)
+        ofst = wfst.compose(ifst, add_markers(self.fst, self.markerbase, len(uniqwords)))
+        pronuns = {}
+        if ofst.start() >= 0:
+            #iterative DFS over the (tree-shaped) output, path[d] is the
+            #output label on the arc into the state at depth d
+            path = []
+            stack = [(ofst.start(), 0, 0)]
+            while stack:
+                state, depth, olabel = stack.pop()
+                del path[depth:]
+                path.append(olabel)
+                for arc in ofst.arcs(state):
+                    if arc.olabel >= self.markerbase:
+                        pronuns[uniqwords[arc.olabel - self.markerbase]] = [self.itos[l] for l in path if l]
+                    else:
+                        stack.append((arc.nextstate, depth + 1, arc.olabel))
+        return [pronuns.get(word) for word in words]
+
+    def predict_word(self, word):
+        pronun = self.predict_words([word])[0]
+        if pronun is None:
+            raise PhoneTokeniseError("Cannot decode output for '{}'".format(word))
+        return pronun
+
+
+if __name__ == "__main__":
+    import codecs
+    import json
+    import argparse
+    import itertools
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('phonesetfile', metavar='PHONESETFILE', type=str, help="File containing the phoneme set (json utf-8).")
+    parser.add_argument('rulesfile', metavar='RULESFILE', type=str, help="File containing the ICU transliteration rules (txt utf-8).")
+    parser.add_argument('--batchsize', metavar='BATCHSIZE', type=int, default=DEF_BATCHSIZE, help="Number of words composed with the transducer at a time.")
+    args = parser.parse_args()
+
+    #load phones
+    with codecs.open(args.phonesetfile, encoding="utf-8") as infh:
+        phoneset = json.load(infh)
+    phones = list(phoneset["phones"].keys())
+    #load rules
+    with codecs.open(args.rulesfile, encoding="utf-8") as infh:
+        rules = infh.read()
+    #predict stdin in batches
+    g2p = G2P_FST(phones, rules)
+    words = (unicode(line.strip(), encoding="utf-8") for line in sys.stdin)
+    while True:
+        batch = list(itertools.islice(words, args.batchsize))
+        if not batch:
+            break
+        for word, pronun in zip(batch, g2p.predict_words(batch)):
+            if pronun is None:
+                #one output line per input word: empty pronunciation
+                print("WARNING: cannot decode output for '{}'".format(word).encode("utf-8"), file=sys.stderr)
+                pronun = []
+            print("{}\t{}".format(word, " ".join(pronun)).encode("utf-8"))
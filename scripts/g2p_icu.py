@@ -7,52 +7,172 @@ from __future__ import unicode_literals, division, print_function #Py2
 __author__ = "Daniel van Niekerk"
 __email__ = "dvn.demitasse@gmail.com"
 
-import re
+import os
+import sys
+from collections import OrderedDict
 
 import icu  # Debian/Ubuntu: apt-get install python-pyicu
 
+from phonetok import PhoneTokeniser, PhoneTokeniseError
+from lexindex import LexIndex
+from icurules import Transliterator, RuleProfile
+from batching import chunked
+
+DEF_CACHESIZE = 10000
+
+
 class G2P_ICURules(object):
-    def __init__(self, phones, rules):
-        phones = list(phones)
-        phones.sort(key=lambda x:len(x), reverse=True)
-        self.phonesre = re.compile("|".join(phones), flags=re.UNICODE)
+    """If a _lexicon_ (e.g. lexindex.LexIndex) is given, words found in it
+       get the stored pronunciation and only the rest are predicted by
+       the rules
+    """
+    def __init__(self, phones, rules, cachesize=DEF_CACHESIZE, lexicon=None):
+        self.phonetok = PhoneTokeniser(phones)
         self.rules = rules
+        self.lexicon = lexicon
         self.transliterator = icu.Transliterator.createFromRules("noname", self.rules, icu.UTransDirection.FORWARD)
+        self.cachesize = cachesize
+        self._init_cache()
 
     def __getstate__(self):
-        return {"phonesre": self.phonesre,
-                "rules": self.rules}
+        return {"phonetok": self.phonetok,
+                "rules": self.rules,
+                "cachesize": self.cachesize,
+                "lexicon": self.lexicon}
 
     def __setstate__(self, d):
         self.__dict__ = d
         self.transliterator = icu.Transliterator.createFromRules("noname", self.rules, icu.UTransDirection.FORWARD)
+        self._init_cache()
 
-    def predict_word(self, word):
+    def _init_cache(self):
+        """LRU cache of predictions (word -> tuple of phones), the most
+           recently used entry is kept at the end
+        """
+        self.cache = OrderedDict()
+        self.cachehits = 0
+        self.cachemisses = 0
+
+    def _predict_word(self, word):
+        """Raises PhoneTokeniseError if the transliteration contains
+           symbols not in the phoneset
+        """
+        if self.lexicon is not None:
+            pronun = self.lexicon.get(word)
+            if pronun is not None:
+                return pronun.split()
         pronun = self.transliterator.transliterate(word)
-        return [e.group(0) for e in self.phonesre.finditer(pronun)]
+        return self.phonetok(pronun)
+
+    def predict_word(self, word):
+        if self.cachesize <= 0:
+            return self._predict_word(word)
+        try:
+            pronun = self.cache.pop(word)
+            self.cachehits += 1
+        except KeyError:
+            self.cachemisses += 1
+            pronun = tuple(self._predict_word(word))
+            if len(self.cache) >= self.cachesize:
+                self.cache.popitem(last=False)
+        self.cache[word] = pronun
+        return list(pronun)
+
+    def cachestats(self):
+        return {"size": len(self.cache),
+                "capacity": self.cachesize,
+                "hits": self.cachehits,
+                "misses": self.cachemisses}
+
+
+def _init_worker(g2p):
+    """Each worker process receives (unpickles) its own G2P instance
+       once
+    """
+    global _worker_g2p
+    _worker_g2p = g2p
+
+def _predict_words(words):
+    """Returns the predictions for _words_ and (process id, cache
+       statistics) of the worker
+    """
+    results = []
+    for word in words:
+        try:
+            results.append((word, _worker_g2p.predict_word(word)))
+        except PhoneTokeniseError as e:
+            #one output line per input word: empty pronunciation
+            print("WARNING: cannot decode '{}': {}".format(word, e.args[0]).encode("utf-8"), file=sys.stderr)
+            results.append((word, []))
+    return results, (os.getpid(), _worker_g2p.cachestats())
 
 
 if __name__ == "__main__":
-    import sys
     import codecs
     import json
     import argparse
+    import multiprocessing
 
     parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('phonesetfile', metavar='PHONESETFILE', type=str, help="File containing the phoneme set (json utf-8).")
     parser.add_argument('rulesfile', metavar='RULESFILE', type=str, help="File containing the ICU transliteration rules (txt utf-8).")
+    parser.add_argument('--cachesize', metavar='CACHESIZE', type=int, default=DEF_CACHESIZE, help="Maximum number of predictions kept in the LRU cache (0 disables caching).")
+    parser.add_argument('--cachestats', action='store_true', help="Print cache statistics on STDERR when done (totals over the worker processes with JOBS > 1).")
+    parser.add_argument('--lexicon', metavar='INDEXFILE', type=str, default=None, help="Pronunciation index (see lexindex.py) consulted before applying the rules.")
+    parser.add_argument('--profile', metavar='FORMAT', type=str, default=None, help="Instead of predicting, report per-rule application counts and time shares over the input words (table|json), using the Python rules interpreter in icurules.py.")
+    parser.add_argument('--profilesort', metavar='FIELD', type=str, default="timeshare", choices=RuleProfile.FIELDS, help="Field to sort the profile by (descending).")
+    parser.add_argument('--jobs', metavar='JOBS', type=int, default=1, help="Number of worker processes.")
+    parser.add_argument('--chunksize', metavar='CHUNKSIZE', type=int, default=1000, help="Number of words sent to a worker process at a time.")
     args = parser.parse_args()
         
     #load phones
     with codecs.open(args.phonesetfile, encoding="utf-8") as infh:
         phoneset = json.load(infh)
     phones = list(phoneset["phones"].keys())
-    assert not any(["|" in ph for ph in phones])
     #load rules
     with codecs.open(args.rulesfile, encoding="utf-8") as infh:
         rules = infh.read()
+    if args.profile is not None:
+        translit = Transliterator(rules)
+        profile = translit.start_profile()
+        for line in sys.stdin:
+            translit(unicode(line.strip(), encoding="utf-8"))
+        rows = sorted(profile.rows(), key=lambda x: x[args.profilesort], reverse=True)
+        if args.profile == "json":
+            print(json.dumps(rows, indent=1, ensure_ascii=False).encode("utf-8"))
+        elif args.profile == "table":
+            print("\t".join(RuleProfile.FIELDS))
+            for row in rows:
+                print("\t".join("{:.6f}".format(row[k]) if isinstance(row[k], float) else "{}".format(row[k]) for k in RuleProfile.FIELDS).encode("utf-8"))
+        else:
+            raise Exception("Invalid profile format specified")
+        sys.exit(0)
+
+    #load lexicon
+    lexicon = None
+    if args.lexicon is not None:
+        lexicon = LexIndex(args.lexicon)
     #predict stdin
-    g2p = G2P_ICURules(phones, rules)
-    for line in sys.stdin:
-        word = unicode(line.strip(), encoding="utf-8")
-        print("{}\t{}".format(word, " ".join(g2p.predict_word(word))).encode("utf-8"))
+    g2p = G2P_ICURules(phones, rules, cachesize=args.cachesize, lexicon=lexicon)
+    words = (unicode(line.strip(), encoding="utf-8") for line in sys.stdin)
+    if args.jobs > 1:
+        #imap returns results in input order
+        pool = multiprocessing.Pool(args.jobs, initializer=_init_worker, initargs=(g2p,))
+        results = pool.imap(_predict_words, chunked(words, args.chunksize))
+    else:
+        _init_worker(g2p)
+        results = (_predict_words([word]) for word in words)
+    workerstats = {} #latest (cumulative) cache statistics per process
+    for chunk, (pid, stats) in results:
+        workerstats[pid] = stats
+        for word, pronun in chunk:
+            print("{}\t{}".format(word, " ".join(pronun)).encode("utf-8"))
+    if args.jobs > 1:
+        pool.close()
+        pool.join()
+    if args.cachestats:
+        if args.jobs > 1:
+            stats = dict((k, sum(s[k] for s in workerstats.values())) for k in ["size", "capacity", "hits", "misses"])
+        else:
+            stats = g2p.cachestats()
+        print("Cache statistics: {}".format(stats), file=sys.stderr)
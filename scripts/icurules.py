@@ -0,0 +1,528 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Pure-Python parser and interpreter for the subset of ICU
+   transliteration rule syntax used in the G2P rule sets
+   (`data/*/g2p.translit.txt`): ordered conversion rules with
+   ante/post-contexts, character classes, anchors and cursor
+   placement, separated into phases by `::Null;` and `::Lower;`.
+
+   The interpreter processes input one character at a time and only
+   keeps the state needed to decide which rule applies next, which
+   makes it possible to enumerate its states (see `g2p_fst.py`).
+"""
+from __future__ import unicode_literals, division, print_function #Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+from collections import defaultdict
+from timeit import default_timer as timer
+
+#conversion operators (in the order they are looked for in a rule)
+OPS = ["↔", "<>", "→", "←", ">", "<"]
+REVERSE_OPS = set(["←", "<"])
+CASEMAPS = {"lower": lambda c: c.lower(),
+            "any-lower": lambda c: c.lower(),
+            "upper": lambda c: c.upper(),
+            "any-upper": lambda c: c.upper()}
+NULLS = set(["null", "any-null"])
+SPECIAL = "{}|[]^$;"
+
+#decisions on whether a rule applies at the cursor
+MATCH, FAIL, UNDECIDED = range(3)
+
+MAX_STEPS_WITHOUT_OUTPUT = 1000
+
+
+class RuleSyntaxError(ValueError):
+    pass
+
+
+class UnsupportedRuleError(RuleSyntaxError):
+    """Valid ICU rule syntax that this parser does not implement"""
+    pass
+
+
+def strip_comment(line):
+    """Remove '#' comments outside quotes and escapes"""
+    quoted = False
+    i = 0
+    while i < len(line):
+        c = line[i]
+        if c == "\\":
+            i += 1
+        elif c == "'":
+            quoted = not quoted
+        elif c == "#" and not quoted:
+            return line[:i]
+        i += 1
+    return line
+
+def split_statements(rules):
+    """Split rule text on ';' outside quotes and escapes, returns pairs
+       of (line number, statement)
+    """
+    statements = []
+    current = []
+    startline = None
+    for lineno, line in enumerate(rules.splitlines(), start=1):
+        line = strip_comment(line)
+        quoted = False
+        i = 0
+        while i < len(line):
+            c = line[i]
+            if c == "\\" and i + 1 < len(line):
+                current.append(line[i:i+2])
+                i += 2
+                continue
+            if c == "'":
+                quoted = not quoted
+            if c == ";" and not quoted:
+                statement = "".join(current).strip()
+                if statement:
+                    statements.append((startline, statement))
+                current = []
+                startline = None
+            else:
+                if startline is None and not c.isspace():
+                    startline = lineno
+                current.append(c)
+            i += 1
+        current.append(" ")
+    if "".join(current).strip():
+        raise RuleSyntaxError("Unterminated rule at line {}".format(startline))
+    return statements
+
+def tokenise_pattern(text):
+    """Split a rule side into tokens: literal characters (unicode),
+       character classes (tuple of (frozenset, negated)) and special
+       single-character operators. Whitespace is ignored outside
+       quotes as in ICU.
+    """
+    tokens = []
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c.isspace():
+            i += 1
+        elif c == "\\":
+            tokens.append(("lit", text[i+1]))
+            i += 2
+        elif c == "'":
+            j = text.index("'", i + 1)
+            if j == i + 1: #'' is a literal apostrophe
+                tokens.append(("lit", "'"))
+            for cc in text[i+1:j]:
+                tokens.append(("lit", cc))
+            i = j + 1
+        elif c == "[":
+            charclass, i = parse_charclass(text, i)
+            tokens.append(("class", charclass))
+        elif c in SPECIAL:
+            tokens.append(("op", c))
+            i += 1
+        else:
+            tokens.append(("lit", c))
+            i += 1
+    return tokens
+
+def parse_charclass(text, i):
+    """Parse a simple UnicodeSet pattern (literals, ranges and
+       negation) starting at text[i] == '['
+    """
+    assert text[i] == "["
+    i += 1
+    negated = False
+    if i < len(text) and text[i] == "^":
+        negated = True
+        i += 1
+    chars = set()
+    prev = None
+    while True:
+        if i >= len(text):
+            raise RuleSyntaxError("Unterminated character class: '{}'".format(text))
+        c = text[i]
+        if c == "]":
+            return (frozenset(chars), negated), i + 1
+        if c.isspace():
+            i += 1
+            continue
+        if c == "[" or c == "$" or c == ":":
+            raise UnsupportedRuleError("Unsupported character class syntax: '{}'".format(text))
+        if c == "\\":
+            i += 1
+            c = text[i]
+        elif c == "-" and prev is not None and text[i+1] != "]":
+            i += 1
+            end = text[i]
+            if end == "\\":
+                i += 1
+                end = text[i]
+            chars.update(chr_range(prev, end))
+            prev = None
+            i += 1
+            continue
+        chars.add(c)
+        prev = c
+        i += 1
+
+def chr_range(start, end):
+    try:
+        return [unichr(i) for i in range(ord(start), ord(end) + 1)]
+    except NameError: #Py3
+        return [chr(i) for i in range(ord(start), ord(end) + 1)]
+
+def literal(c):
+    return (frozenset([c]), False)
+
+def elem_matches(elem, c):
+    chars, negated = elem
+    return (c in chars) != negated
+
+def matches_ether(elem):
+    """Negated classes also match (with zero width) at the start or end
+       of the text, as ICU sets containing U+FFFF do
+    """
+    return elem[1]
+
+def prefix_matches(patterns, s):
+    """Whether _s_ matches the first len(s) elements of any pattern"""
+    return any(len(p) >= len(s) and all(elem_matches(e, c) for e, c in zip(p, s)) for p in patterns)
+
+
+class Rule(object):
+    """A single forward conversion rule:
+           [^] ante { key } post [$] → output (with optional '|' cursor)
+    """
+    def __init__(self, lhs, rhs, text="", lineno=None):
+        self.text = text
+        self.lineno = lineno
+        self.anteanchor = False
+        self.postanchor = False
+        tokens = tokenise_pattern(lhs)
+        if tokens and tokens[0] == ("op", "^"):
+            self.anteanchor = True
+            tokens = tokens[1:]
+        if tokens and tokens[-1] == ("op", "$"):
+            self.postanchor = True
+            tokens = tokens[:-1]
+        ante, key, post = [], [], []
+        current = key
+        for kind, value in tokens:
+            if kind == "op":
+                if value == "{" and current is key and not ante and not post:
+                    ante, key = key, []
+                    current = key
+                elif value == "}" and current is key and not post:
+                    current = post
+                else:
+                    raise RuleSyntaxError("Unexpected '{}' in rule: '{}'".format(value, text))
+            elif kind == "lit":
+                current.append(literal(value))
+            else:
+                current.append(value)
+        self.ante = ante
+        self.key = key
+        self.post = post
+        self.output = ""
+        self.cursor = None
+        for kind, value in tokenise_pattern(rhs):
+            if (kind, value) == ("op", "|"):
+                if self.cursor is not None:
+                    raise RuleSyntaxError("Multiple cursors in rule: '{}'".format(text))
+                self.cursor = len(self.output)
+            elif kind == "lit":
+                self.output += value
+            else:
+                raise RuleSyntaxError("Unsupported output syntax in rule: '{}'".format(text))
+        if self.cursor is None:
+            self.cursor = len(self.output)
+        self.keypost = self.key + self.post
+
+    def match_ante(self, hist, atstart):
+        """Match the ante-context backwards from the end of _hist_
+           (_atstart_ indicates that _hist_ is the complete output)
+        """
+        j = len(hist)
+        for elem in reversed(self.ante):
+            if j > 0:
+                if not elem_matches(elem, hist[j-1]):
+                    return False
+                j -= 1
+            elif not (atstart and matches_ether(elem)):
+                return False
+        if self.anteanchor and not (atstart and j == 0):
+            return False
+        return True
+
+    def match_keypost(self, buf, final):
+        """Match key and post-context at the start of _buf_, returns the
+           decision and the length of the matched key. If _buf_ is too
+           short to decide and more input may follow the decision is
+           UNDECIDED.
+        """
+        j = 0
+        keylen = None
+        for i, elem in enumerate(self.keypost):
+            if i == len(self.key):
+                keylen = j
+            if j < len(buf):
+                if not elem_matches(elem, buf[j]):
+                    return FAIL, 0
+                j += 1
+            elif not final:
+                return UNDECIDED, 0
+            elif not matches_ether(elem):
+                return FAIL, 0
+        if keylen is None:
+            keylen = j
+        if self.postanchor:
+            if j != len(buf):
+                return FAIL, 0
+            if not final:
+                return UNDECIDED, 0
+        return MATCH, keylen
+
+    def __str__(self):
+        return self.text
+
+
+class CaseMapPhase(object):
+    """Stateless phase (e.g. `::Lower;`) mapping each character
+    """
+    def __init__(self, name):
+        self.name = name
+        self.casemap = CASEMAPS[name.lower()]
+
+    def initial(self):
+        return None
+
+    def feed(self, state, s):
+        return state, "".join(self.casemap(c) for c in s)
+
+    def flush(self, state):
+        return ""
+
+
+class RulePhase(object):
+    """Ordered conversion rules applied left to right: at the cursor the
+       first rule (in order) that matches is applied, if none matches
+       the character is copied. Ante-contexts match the output already
+       produced and post-contexts the unprocessed input, as in ICU.
+
+       The state is (hist, atstart, buf) where _buf_ is the unprocessed
+       input at the cursor and _hist_ the longest suffix of the output
+       that could still (partially) match an ante-context.
+    """
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.antes = [r.ante for r in self.rules if r.ante]
+        #tails of ante-contexts that may match at the start of the text
+        self.startantes = []
+        for a in self.antes:
+            for k in range(1, len(a) + 1):
+                if not matches_ether(a[k-1]):
+                    break
+                self.startantes.append(a[k:])
+        self._index = {}
+        self._histcache = {}
+        self.profile = None
+
+    def initial(self):
+        return ("", True, "")
+
+    def rules_for(self, c):
+        """Rules that may apply with _c_ at the cursor, in order"""
+        try:
+            return self._index[c]
+        except KeyError:
+            rules = [r for r in self.rules if not r.keypost or elem_matches(r.keypost[0], c)]
+            self._index[c] = rules
+            return rules
+
+    def _push_hist(self, hist, atstart, c):
+        try:
+            return self._histcache[(hist, atstart, c)]
+        except KeyError:
+            pass
+        s = hist + c
+        result = "", False
+        if atstart and prefix_matches(self.startantes, s):
+            result = s, True
+        else:
+            for i in range(len(s) + 1):
+                suffix = s[i:]
+                if prefix_matches(self.antes, suffix):
+                    result = suffix, atstart and i == 0
+                    break
+        self._histcache[(hist, atstart, c)] = result
+        return result
+
+    def select(self, hist, atstart, buf, final):
+        """Returns (rule, decision, keylen) for the rule applying at the
+           start of buf; rule is None if no rule applies
+        """
+        for rule in self.rules_for(buf[0]):
+            if (rule.ante or rule.anteanchor) and not rule.match_ante(hist, atstart):
+                continue
+            decision, keylen = rule.match_keypost(buf, final)
+            if decision == FAIL:
+                continue
+            return rule, decision, keylen
+        return None, MATCH, 1
+
+    def _select_profiled(self, hist, atstart, buf, final):
+        """As select() recording the attempts and matching time per rule
+        """
+        for rule in self.rules_for(buf[0]):
+            starttime = timer()
+            if (rule.ante or rule.anteanchor) and not rule.match_ante(hist, atstart):
+                self.profile.attempt(rule, timer() - starttime)
+                continue
+            decision, keylen = rule.match_keypost(buf, final)
+            self.profile.attempt(rule, timer() - starttime)
+            if decision == FAIL:
+                continue
+            return rule, decision, keylen
+        return None, MATCH, 1
+
+    def _run(self, state, final):
+        hist, atstart, buf = state
+        out = []
+        steps = 0
+        while buf:
+            if self.profile is None:
+                rule, decision, keylen = self.select(hist, atstart, buf, final)
+            else:
+                rule, decision, keylen = self._select_profiled(hist, atstart, buf, final)
+            if decision == UNDECIDED:
+                break
+            if self.profile is not None:
+                self.profile.apply(self, rule)
+            if rule is None:
+                emitted, buf = buf[0], buf[1:]
+            else:
+                emitted = rule.output[:rule.cursor]
+                buf = rule.output[rule.cursor:] + buf[keylen:]
+            for c in emitted:
+                hist, atstart = self._push_hist(hist, atstart, c)
+            out.append(emitted)
+            steps = 0 if emitted else steps + 1
+            if steps > MAX_STEPS_WITHOUT_OUTPUT:
+                raise RuntimeError("Rules do not advance the cursor: '{}'".format(rule))
+        return (hist, atstart, buf), "".join(out)
+
+    def feed(self, state, s):
+        hist, atstart, buf = state
+        return self._run((hist, atstart, buf + s), final=False)
+
+    def flush(self, state):
+        state, out = self._run(state, final=True)
+        assert not state[2]
+        return out
+
+
+def parse_rules(rules):
+    """Parse ICU transliteration rules text into a list of phases
+    """
+    phases = []
+    current = []
+    for lineno, statement in split_statements(rules):
+        if statement.startswith("::"):
+            if current:
+                phases.append(RulePhase(current))
+                current = []
+            name = statement[2:].strip()
+            if name.lower() in CASEMAPS:
+                phases.append(CaseMapPhase(name))
+            elif name.lower() not in NULLS:
+                raise UnsupportedRuleError("Unsupported transform: '{}'".format(statement))
+            continue
+        if statement.startswith("$") and "=" in statement:
+            raise UnsupportedRuleError("Variables are not supported: '{}'".format(statement))
+        for op in OPS:
+            if op in statement:
+                lhs, rhs = statement.split(op, 1)
+                break
+        else:
+            raise RuleSyntaxError("No conversion operator at line {}: '{}'".format(lineno, statement))
+        if op in REVERSE_OPS:
+            continue
+        current.append(Rule(lhs, rhs, text=statement, lineno=lineno))
+    if current:
+        phases.append(RulePhase(current))
+    return phases
+
+
+class Transliterator(object):
+    """Applies phases in sequence, each phase processes the complete
+       output of the previous
+    """
+    def __init__(self, rules):
+        self.phases = parse_rules(rules)
+
+    def start_profile(self):
+        """Start recording rule statistics in the returned RuleProfile
+        """
+        profile = RuleProfile(self.phases)
+        for phase in self.phases:
+            if isinstance(phase, RulePhase):
+                phase.profile = profile
+        return profile
+
+    def stop_profile(self):
+        for phase in self.phases:
+            if isinstance(phase, RulePhase):
+                phase.profile = None
+
+    def transliterate(self, s):
+        for phase in self.phases:
+            state, out = phase.feed(phase.initial(), s)
+            s = out + phase.flush(state)
+        return s
+
+    def __call__(self, s):
+        return self.transliterate(s)
+
+
+class RuleProfile(object):
+    """Per-rule counts of attempts (rule tried at the cursor) and
+       applications, and the time spent matching each rule. Characters
+       copied because no rule applied are counted per phase.
+
+       Times are measured in this interpreter and are a proxy for the
+       relative cost of the rules in ICU.
+    """
+    FIELDS = ["phase", "line", "rule", "attempts", "applications", "time", "timeshare"]
+
+    def __init__(self, phases):
+        self.phases = phases
+        self.attempts = defaultdict(int)
+        self.applications = defaultdict(int)
+        self.time = defaultdict(float)
+        self.copies = defaultdict(int)
+
+    def attempt(self, rule, t):
+        self.attempts[rule] += 1
+        self.time[rule] += t
+
+    def apply(self, phase, rule):
+        if rule is None:
+            self.copies[phase] += 1
+        else:
+            self.applications[rule] += 1
+
+    def rows(self):
+        totaltime = sum(self.time.values()) or 1.0
+        rows = []
+        for i, phase in enumerate(self.phases):
+            if not isinstance(phase, RulePhase):
+                continue
+            for rule in phase.rules:
+                rows.append({"phase": i, "line": rule.lineno, "rule": rule.text,
+                             "attempts": self.attempts[rule], "applications": self.applications[rule],
+                             "time": self.time[rule], "timeshare": self.time[rule] / totaltime})
+            rows.append({"phase": i, "line": None, "rule": "<no rule: copy>",
+                         "attempts": 0, "applications": self.copies[phase],
+                         "time": 0.0, "timeshare": 0.0})
+        return rows
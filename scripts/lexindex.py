@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Build a sorted, memory-mapped pronunciation index from a text
+   dictionary (dictionary on STDIN, index filename as argument). The
+   index allows O(log n) lookup without parsing the dictionary at
+   load time.
+
+   File layout (little-endian): MAGIC, number of entries (n), n+1
+   record offsets (uint32) relative to the start of the records, and
+   the records "word<TAB>pronunciation" (UTF-8) sorted by word.
+"""
+from __future__ import unicode_literals, division, print_function #Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import mmap
+import struct
+
+MAGIC = b"ZALEXIDX1\n"
+SEP = b"\t"
+UINT = struct.Struct("<I")
+
+
+def write_index(entries, fn):
+    """Write (word, pronunciation) pairs to an index file, for repeated
+       words only the first entry is kept
+    """
+    records = {}
+    for word, pronun in entries:
+        key = word.encode("utf-8")
+        assert SEP not in key
+        if key not in records:
+            records[key] = key + SEP + pronun.encode("utf-8")
+    keys = sorted(records)
+    offsets = [0]
+    for key in keys:
+        offsets.append(offsets[-1] + len(records[key]))
+    with open(fn, "wb") as outfh:
+        outfh.write(MAGIC)
+        outfh.write(UINT.pack(len(keys)))
+        outfh.write(struct.pack("<{}I".format(len(offsets)), *offsets))
+        for key in keys:
+            outfh.write(records[key])
+
+
+class LexIndex(object):
+    """Read-only mapping from words to pronunciations (space-separated
+       phones) backed by a memory-mapped index file
+    """
+    def __init__(self, fn):
+        self.fn = fn
+        self._open()
+
+    def _open(self):
+        with open(self.fn, "rb") as infh:
+            self.mm = mmap.mmap(infh.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not a lexicon index file: {}".format(self.fn))
+        self.n = UINT.unpack_from(self.mm, len(MAGIC))[0]
+        self.offsetsstart = len(MAGIC) + UINT.size
+        self.recordsstart = self.offsetsstart + (self.n + 1) * UINT.size
+
+    def __getstate__(self):
+        return {"fn": self.fn}
+
+    def __setstate__(self, d):
+        self.__dict__ = d
+        self._open()
+
+    def __len__(self):
+        return self.n
+
+    def _record(self, i):
+        start, end = struct.unpack_from("<2I", self.mm, self.offsetsstart + i * UINT.size)
+        return self.recordsstart + start, self.recordsstart + end
+
+    def _key(self, i):
+        start, end = self._record(i)
+        return self.mm[start:self.mm.find(SEP, start, end)]
+
+    def _bisect(self, key):
+        """Index of the first record with a key >= _key_"""
+        lo, hi = 0, self.n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def get(self, word, default=None):
+        key = word.encode("utf-8")
+        i = self._bisect(key)
+        if i < self.n:
+            start, end = self._record(i)
+            if self.mm[start:start+len(key)+1] == key + SEP:
+                return self.mm[start+len(key)+1:end].decode("utf-8")
+        return default
+
+    def __getitem__(self, word):
+        pronun = self.get(word)
+        if pronun is None:
+            raise KeyError(word)
+        return pronun
+
+    def __contains__(self, word):
+        return self.get(word) is not None
+
+
+if __name__ == "__main__":
+    import sys
+    import codecs
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('indexfile', metavar='INDEXFILE', type=str, help="Output index file.")
+    parser.add_argument('--informat', metavar='INPUTFORMAT', default="simple", help="dictionary format (simple|flat): 'simple' is 'word phones...' (e.g. NCHLT) and 'flat' is 'word pos stresspat sylspec phones...'")
+    parser.add_argument('--mapfile', metavar='MAPFILE', type=str, default=None, help="File containing phone mapping (e.g. 'phonememap.ipa-nchlt.tsv').")
+    parser.add_argument('--mapreverse', action='store_true', help="Apply mapping file in reverse.")
+    args = parser.parse_args()
+
+    phmap = None
+    if args.mapfile is not None:
+        phmap = {}
+        with codecs.open(args.mapfile, encoding="utf-8") as infh:
+            for line in infh:
+                a, b = line.split()
+                if args.mapreverse:
+                    a, b = (b, a)
+                phmap[a] = b
+
+    warnings = set()
+    def mapphone(ph, word):
+        try:
+            return phmap[ph]
+        except KeyError:
+            if not ph in warnings:
+                print("WARNING: Did not map /{}/ (in '{}')".format(ph, word).encode("utf-8"), file=sys.stderr)
+                warnings.add(ph)
+            return ph
+
+    def entries():
+        for line in sys.stdin:
+            fields = unicode(line, encoding="utf-8").split()
+            if not fields:
+                continue
+            if args.informat == "simple":
+                word, phones = fields[0], fields[1:]
+            elif args.informat == "flat":
+                word, phones = fields[0], fields[4:]
+            else:
+                raise Exception("Invalid input format specified")
+            if phmap is not None:
+                phones = [mapphone(ph, word) for ph in phones]
+            yield word, " ".join(phones)
+
+    write_index(entries(), args.indexfile)
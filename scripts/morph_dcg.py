@@ -17,15 +17,32 @@ __email__ = "dvn.demitasse@gmail.com"
 import os, sys
 import codecs, pickle
 import re
+import itertools
+import heapq
 from collections import defaultdict
 import tempfile
 import pprint
+import json
+import hashlib
+import shutil
+import multiprocessing
+from timeit import default_timer as timer
 
 import pywrapfst as wfst # Install OpenFST 1.5.4 or later and build with Python bindings
 
+from fstbatch import make_inputtrie, add_markers
+
 
 RULE_RE = re.compile("(?P<head>\w+)\s*\-\-\>\s*(?P<body>.+?)\.")
 EPS = "_"
+#increment when the compiled FSTs or the cache layout change
+CACHE_VERSION = 3
+#type of the compiled POS FSTs (immutable, see make_static())
+DEF_FSTTYPE = "const"
+#the open-class portion of a word (minimised by the simple guess) is
+#between these labels
+STEMSTART = "st"
+STEMEND = "sf"
 
 def load_simpledcg(dcg):
     terminals = defaultdict(list)
@@ -107,7 +124,7 @@ def make_termfsts(dcg, graphs, stoi):
 
 
 def save_dot(fst, stoi=None, fn="_fst.dot"):
-    fst = fst.copy()
+    fst = wfst.convert(fst, "vector")
     if stoi is not None:
         st = wfst.SymbolTable()
         for k, v in stoi.iteritems():
@@ -130,6 +147,97 @@ def make_input(chars, stoi):
     return fst
 
 
+def make_transducer(fst, stoi):
+    """Convert an acceptor over grammar symbols into a transducer:
+       split I/O symbols by convention here: input symbols are single
+       characters
+    """
+    #Input syms (relabel outputs to EPS):
+    syms = [k for k in stoi if len(k) == 1]
+    labpairs = map(lambda x: (stoi[x], stoi[EPS]), syms)
+    fst.relabel_pairs(opairs=labpairs)
+    #Output syms (relabel inputs to EPS):
+    syms = [k for k in stoi if len(k) != 1]
+    labpairs = map(lambda x: (stoi[x], stoi[EPS]), syms)
+    fst.relabel_pairs(ipairs=labpairs)
+    return fst
+
+
+def make_stemweights(stoi):
+    """Weighted acceptor over all grammar symbols with a cost of one for
+       each character from the first STEMSTART label up to the next
+       STEMEND label (the stem)
+    """
+    fst = wfst.Fst()
+    one = wfst.Weight.One(fst.weight_type())
+    charcost = wfst.Weight(fst.weight_type(), 1)
+    before, stem, after = [fst.add_state() for i in range(3)]
+    fst.set_start(before)
+    for state in [before, stem, after]:
+        fst.set_final(state, one)
+    for sym, i in stoi.iteritems():
+        if sym == EPS:
+            continue
+        nextstates = {before: before, stem: stem, after: after}
+        if sym == STEMSTART:
+            nextstates[before] = stem
+        elif sym == STEMEND:
+            nextstates[stem] = after
+        for state in [before, stem, after]:
+            weight = charcost if len(sym) == 1 and state == stem else one
+            fst.add_arc(state, wfst.Arc(i, i, weight, nextstates[state]))
+    fst.arcsort(sort_type="ilabel")
+    return fst
+
+
+def make_union(fsts, itos, stoi, fsttype=DEF_FSTTYPE):
+    """Union of the POS FSTs, each path starting with an arc outputting
+       a POS marker: returns the FST and symbol map with the marker
+       labels (above the symbol table) mapped to the POS names
+    """
+    one = wfst.Weight.One(wfst.Fst().weight_type())
+    unionitos = dict(itos)
+    unionfst = None
+    for i, pos in enumerate(sorted(fsts)):
+        marker = max(itos) + 1 + i
+        unionitos[marker] = pos
+        fst = wfst.Fst()
+        start = fst.add_state()
+        end = fst.add_state()
+        fst.set_start(start)
+        fst.set_final(end, one)
+        fst.add_arc(start, wfst.Arc(stoi[EPS], marker, one, end))
+        fst.concat(fsts[pos])
+        if unionfst is None:
+            unionfst = fst
+        else:
+            unionfst.union(fst)
+    unionfst.rmepsilon()
+    return make_static(unionfst, fsttype), unionitos
+
+
+def grammar_deps(dcg):
+    """Symbols (nonterminals, terminals or undefined) referenced
+       directly by each nonterminal
+    """
+    return dict((head, set(sym for body in bodies for sym in body))
+                for head, bodies in dcg["nonterminals"].iteritems())
+
+
+def reachable(s, deps):
+    """Symbols reachable from _s_ (including _s_) in the dependency
+       graph _deps_
+    """
+    seen = set()
+    stack = [s]
+    while stack:
+        s = stack.pop()
+        if s not in seen:
+            seen.add(s)
+            stack.extend(deps.get(s, []))
+    return seen
+
+
 def make_rtn(s, dcg, stoi, fstcoll):
     fst = wfst.Fst()
     start = fst.add_state()
@@ -151,10 +259,152 @@ def make_rtn(s, dcg, stoi, fstcoll):
     return fstcoll
 
 
+def fst_size(fst):
+    """Returns the number of states and arcs of _fst_"""
+    states = list(fst.states())
+    return len(states), sum(fst.num_arcs(s) for s in states)
+
+
+def make_static(fst, fsttype=DEF_FSTTYPE):
+    """Immutable FST of type _fsttype_ (e.g. "const" or, for unweighted
+       FSTs, "compact_unweighted") with arcs sorted on input labels, the
+       side matched when composing with input words
+    """
+    fst.arcsort(sort_type="ilabel")
+    return wfst.convert(fst, fsttype)
+
+
+def compile_pos(pos, dcg, descr, stoi, terms, termfsts, stemweights, rtnfst=None, fsttype=DEF_FSTTYPE):
+    """Expand the grammar of _pos_ (from _rtnfst_, the FST with
+       nonterminals replaced, if given) over the terminal symbols
+       _terms_. Returns the FST with nonterminals replaced, the final
+       transducer (of type _fsttype_), the transducer weighted by stem
+       length for the simple guess ("const") and a list of (pos, phase,
+       stage, seconds, states, arcs) for each compilation stage
+    """
+    stats = []
+    def logstage(phase, stage, starttime, fst):
+        stats.append((pos, phase, stage, timer() - starttime) + fst_size(fst))
+    def optimise(phase, fst):
+        starttime = timer()
+        fst.rmepsilon()
+        logstage(phase, "rmepsilon", starttime, fst)
+        starttime = timer()
+        fst = wfst.determinize(fst)
+        logstage(phase, "determinize", starttime, fst)
+        starttime = timer()
+        fst.minimize()
+        logstage(phase, "minimize", starttime, fst)
+        return fst
+
+    if rtnfst is None:
+        print("Making/expanding non-terminal fst for POS:", pos, file=sys.stderr)
+        starttime = timer()
+        fstcoll = make_rtn(pos, dcg["nonterminals"], stoi, {})
+        sizes = [fst_size(fst) for fst in fstcoll.values()]
+        stats.append((pos, "nonterminals", "rtn", timer() - starttime, sum(e[0] for e in sizes), sum(e[1] for e in sizes)))
+        # print("__init__(): fstcoll: {}".format(fstcoll.keys()), file=sys.stderr)
+        # for sym in fstcoll:
+        #     #DEBUG DUMP FST
+        #     save_dot(fstcoll[sym], stoi, "tmp/"+pos+"_orig_"+sym+".dot")
+        #     fstcoll[sym].write("tmp/"+pos+"_orig_"+sym+".fst")
+
+        #replace non-terminals
+        starttime = timer()
+        replace_pairs = [(stoi[pos], fstcoll.pop(pos))]
+        for k in sorted(fstcoll):
+            replace_pairs.append((stoi[k], fstcoll[k]))
+        rtnfst = wfst.replace(replace_pairs, call_arc_labeling="both")
+        logstage("nonterminals", "replace", starttime, rtnfst)
+        rtnfst = optimise("nonterminals", rtnfst)
+        # #DEBUG DUMP FST
+        # save_dot(rtnfst, stoi, "tmp/"+pos+"_expanded.dot")
+        # rtnfst.write("tmp/"+pos+"_expanded.fst")
+        # if True: #DEBUGGING
+        #     fst2 = rtnfst.copy()
+        #     #rename symbols (simplify) 
+        #     if pos in descr["renamesyms"] and descr["renamesyms"][pos]:
+        #         labpairs = map(lambda x: (stoi[x[0]], stoi[x[1]]), descr["renamesyms"][pos])
+        #         fst2.relabel_pairs(opairs=labpairs, ipairs=labpairs)
+        #     fst2.rmepsilon()
+        #     fst2 = wfst.determinize(fst2)
+        #     fst2.minimize()            
+        #     #DEBUG DUMP FST
+        #     save_dot(fst2, stoi, "tmp/"+pos+"_expandedsimple.dot")
+        #     fst2.write("tmp/"+pos+"_expandedsimple.fst")            
+    else:
+        print("Reusing non-terminal fst for POS:", pos, file=sys.stderr)
+
+    #replace terminals
+    starttime = timer()
+    replace_pairs = [(stoi[pos], rtnfst)]
+    for k in terms:
+        replace_pairs.append((stoi[k], termfsts[k]))
+    fst = wfst.replace(replace_pairs, call_arc_labeling="both")
+    logstage("terminals", "replace", starttime, fst)
+    fst = optimise("terminals", fst)
+    # #DEBUG DUMP FST
+    # save_dot(fst, stoi, "tmp/"+pos+"_expanded2.dot")
+    # fst.write("tmp/"+pos+"_expanded2.fst")
+
+    #rename symbols (simplify) JUST FOR DEBUGGING
+    starttime = timer()
+    if pos in descr["renamesyms"] and descr["renamesyms"][pos]:
+        labpairs = map(lambda x: (stoi[x[0]], stoi[x[1]]), descr["renamesyms"][pos])
+        fst.relabel_pairs(opairs=labpairs, ipairs=labpairs)
+    logstage("rename", "relabel", starttime, fst)
+    fst = optimise("rename", fst)
+    # #DEBUG DUMP FST
+    # save_dot(fst, stoi, "tmp/"+pos+"_prefinal.dot")
+    # fst.write("tmp/"+pos+"_prefinal.fst")
+
+    #Same paths weighted by stem length for the simple guess
+    starttime = timer()
+    simplefst = make_transducer(wfst.compose(fst, stemweights), stoi)
+    logstage("simple", "compose+relabel", starttime, simplefst)
+    #Convert into transducer:
+    starttime = timer()
+    fst = make_transducer(fst, stoi)
+    logstage("transducer", "relabel", starttime, fst)
+    # #DEBUG DUMP FST
+    # save_dot(fst, stoi, "tmp/"+pos+"_final.dot")
+    # fst.write("tmp/"+pos+"_final.fst")
+    starttime = timer()
+    fst = make_static(fst, fsttype)
+    simplefst = make_static(simplefst)
+    logstage("transducer", "arcsort+convert", starttime, fst)
+    return rtnfst, fst, simplefst, stats
+
+
+def _init_compile_worker(dcg, descr, stoi, fsttype, serialise):
+    """Each worker process makes the terminal FSTs once, FSTs are
+       exchanged serialised if _serialise_
+    """
+    global _worker_compileargs, _worker_serialise
+    termfsts = make_termfsts(dcg, descr["graphs"], stoi)
+    # #DEBUG DUMP FST
+    # for k in termfsts:
+    #     print("DEBUG dumping:", k, file=sys.stderr)
+    #     save_dot(termfsts[k], stoi, "tmp/termfst_"+k+".dot")
+    #     termfsts[k].write("tmp/termfst_"+k+".fst")
+    _worker_compileargs = (dcg, descr, stoi, termfsts, make_stemweights(stoi), fsttype)
+    _worker_serialise = serialise
+
+def _compile_pos_job(job):
+    pos, terms, rtnfst = job
+    dcg, descr, stoi, termfsts, stemweights, fsttype = _worker_compileargs
+    if _worker_serialise and rtnfst is not None:
+        rtnfst = fst_from_bytes(rtnfst)
+    result = compile_pos(pos, dcg, descr, stoi, terms, termfsts, stemweights, rtnfst, fsttype)
+    if _worker_serialise:
+        result = tuple(fst_to_bytes(fst) for fst in result[:3]) + result[3:]
+    return result
+
+
 class Morphparse(object):
     """Abstract class just to define the required interface...
     """
-    def parse(self, word):
+    def parse(self, word, pos=None, max_parses=None):
         """Takes a string and returns a list of "parses" where morph labels
         encapsulated by <> precede the string associated with it, for
         example:
@@ -162,6 +412,10 @@ class Morphparse(object):
               "<word><noun><iv_n11>u<nst2><nr>mnumzana",
               ...
              ]
+        The parses are sorted (before bounds are simplified) and if
+        _max_parses_ is given, the first _max_parses_ of these are
+        returned: parse(word, max_parses=n) == parse(word)[:n] for all
+        implementations (see first_parses())
         """
         raise NotImplementedError
         
@@ -169,8 +423,186 @@ class Morphparse(object):
         return self.parse(word)
 
 
+def fst_to_bytes(fst, tmpfile=False):
+    """Serialise _fst_ in memory (through a temporary file with older
+       bindings which lack `write_to_string`)
+    """
+    if hasattr(fst, "write_to_string") and not tmpfile:
+        return fst.write_to_string()
+    try:
+        fd, path = tempfile.mkstemp()
+        fst.write(path)
+        with open(path, "rb") as infh:
+            return infh.read()
+    finally:
+        os.close(fd)
+        os.remove(path)
+
+
+def fst_from_bytes(serialisedfst, tmpfile=False):
+    if hasattr(wfst.Fst, "read_from_string") and not tmpfile:
+        return wfst.Fst.read_from_string(serialisedfst)
+    try:
+        fd, path = tempfile.mkstemp()
+        with open(path, "wb") as outfh:
+            outfh.write(serialisedfst)
+        return wfst.Fst.read(path)
+    finally:
+        os.close(fd)
+        os.remove(path)
+
+
+def part_key(*parts):
+    h = hashlib.sha1()
+    h.update(json.dumps([CACHE_VERSION] + list(parts), sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+class PartCache(object):
+    """Compiled grammar parts (FSTs) by key, kept in memory and in
+       files in the directory _path_ if given
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.fsts = {}
+        if self.path is not None and not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, d):
+        self.__dict__ = d
+        self.fsts = {}
+
+    def get(self, key):
+        if key not in self.fsts and self.path is not None:
+            fn = os.path.join(self.path, key + ".fst")
+            if os.path.isfile(fn):
+                self.fsts[key] = wfst.Fst.read(fn)
+        return self.fsts.get(key)
+
+    def put(self, key, fst):
+        self.fsts[key] = fst
+        if self.path is not None:
+            #rename so that an incomplete file is never read
+            fd, tmpfn = tempfile.mkstemp(dir=self.path)
+            os.close(fd)
+            fst.write(tmpfn)
+            os.rename(tmpfn, os.path.join(self.path, key + ".fst"))
+
+
+def grammar_key(dcg, descr, fsttype=DEF_FSTTYPE):
+    """Hash of the (loaded) DCG, its description and the FST type
+       identifying the compiled FSTs in the cache
+    """
+    return part_key(dcg, descr, fsttype)
+
+
 class Morphparse_DCG(Morphparse):
-    def __init__(self, dcg, descr):
+    def __init__(self, dcg, descr, cachedir=None, unified=False, compilejobs=1, fsttype=DEF_FSTTYPE):
+        """If _cachedir_ is given the compiled FSTs are loaded from (or
+           after compilation saved to) a directory in _cachedir_ named
+           by the hash of the grammar, intermediate FSTs are kept in
+           _cachedir_ for recompilation (see recompile())
+
+           If _unified_ the POS FSTs are also combined into a single
+           transducer so that parsing a word (for all POS) takes one
+           composition
+
+           With _compilejobs_ > 1 the POS FSTs are compiled in parallel
+           by that many processes, the time taken and size after each
+           stage are in _compilestats_ (see compile_pos())
+
+           The POS FSTs are immutable, arc-sorted FSTs of type _fsttype_
+           (see make_static()) and are loaded from the cache as such
+        """
+        self.unified = unified
+        self.fsttype = fsttype
+        self.compilejobs = compilejobs
+        self.cachedir = cachedir
+        partpath = None
+        if cachedir is not None:
+            if not os.path.isdir(cachedir):
+                os.makedirs(cachedir)
+            partpath = os.path.join(cachedir, "morphdcg-v{}-parts".format(CACHE_VERSION))
+        self.partcache = PartCache(partpath)
+        self._load(dcg, descr)
+
+    def recompile(self, dcg, descr):
+        """Recompile after edits to the grammar: only the POS FSTs
+           depending on edited rules are rebuilt, from the parts of
+           earlier compilations (also kept in _cachedir_ if given)
+        """
+        self._load(dcg, descr)
+
+    def _load(self, dcg, descr):
+        cachepath = None
+        if self.cachedir is not None:
+            cachepath = os.path.join(self.cachedir, "morphdcg-v{}-{}".format(CACHE_VERSION, grammar_key(dcg, descr, self.fsttype)))
+        if cachepath is not None and os.path.isdir(cachepath):
+            print("Loading compiled FSTs from cache:", cachepath, file=sys.stderr)
+            self._load_cache(cachepath)
+            self.compilestats = []
+        else:
+            self._compile(dcg, descr)
+            if cachepath is not None:
+                print("Saving compiled FSTs to cache:", cachepath, file=sys.stderr)
+                self._save_cache(cachepath)
+        if self.unified:
+            self._make_union()
+        #word markers for parse_batch() are above the symbols and the
+        #POS markers of the union
+        self.markerbase = max(self.itos) + len(self.fsts) + 1
+        self.markedfsts = {}
+
+    def _make_union(self):
+        self.unionfst, self.unionitos = make_union(self.fsts, self.itos, self.stoi, self.fsttype)
+        self.simpleunionfst = make_union(self.simplefsts, self.itos, self.stoi)[0]
+
+    def _markedfst(self, pos, nmarkers):
+        """The POS FST (or the union if _pos_ is None) accepting word
+           markers for parse_batch(), extended only when a larger batch
+           is seen
+        """
+        if pos not in self.markedfsts or self.markedfsts[pos][0] < nmarkers:
+            fst = self.unionfst if pos is None else self.fsts[pos]
+            self.markedfsts[pos] = (nmarkers, make_static(add_markers(fst, self.markerbase, nmarkers), self.fsttype))
+        return self.markedfsts[pos][1]
+
+    def _save_cache(self, cachepath):
+        #write to a temporary directory first so that an incomplete cache
+        #is never loaded
+        tmppath = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(cachepath)))
+        try:
+            for pos in self.fsts:
+                self.fsts[pos].write(os.path.join(tmppath, pos + ".fst"))
+                self.simplefsts[pos].write(os.path.join(tmppath, pos + ".simple.fst"))
+            meta = {"version": CACHE_VERSION,
+                    "pos": sorted(self.fsts),
+                    "bounds": self.bounds,
+                    "itos": sorted(self.itos.items())}
+            with codecs.open(os.path.join(tmppath, "meta.json"), "w", encoding="utf-8") as outfh:
+                json.dump(meta, outfh, ensure_ascii=False)
+            os.rename(tmppath, cachepath)
+        except Exception:
+            shutil.rmtree(tmppath, ignore_errors=True)
+            if not os.path.isdir(cachepath): #else written concurrently
+                raise
+
+    def _load_cache(self, cachepath):
+        with codecs.open(os.path.join(cachepath, "meta.json"), encoding="utf-8") as infh:
+            meta = json.load(infh)
+        self.bounds = meta["bounds"]
+        self.itos = dict((i, s) for i, s in meta["itos"])
+        self.stoi = dict((s, i) for i, s in self.itos.iteritems())
+        self.fsts = {}
+        self.simplefsts = {}
+        for pos in meta["pos"]:
+            self.fsts[pos] = wfst.Fst.read(os.path.join(cachepath, pos + ".fst"))
+            self.simplefsts[pos] = wfst.Fst.read(os.path.join(cachepath, pos + ".simple.fst"))
+
+    def _compile(self, dcg, descr):
         #print("Morphparse_DCG.__init__()", file=sys.stderr)
         #print("dcg[nonterminals]: {}".format(pprint.pformat(dcg["nonterminals"])), file=sys.stderr)
         ###Make symbol tables
@@ -186,127 +618,96 @@ class Morphparse_DCG(Morphparse):
         # with codecs.open("tmp/itos.pickle", "w", encoding="utf-8") as outfh:
         #     pickle.dump(self.itos, outfh)
 
-        termfsts = make_termfsts(dcg, descr["graphs"], self.stoi)
-        # #DEBUG DUMP FST
-        # for k in termfsts:
-        #     print("DEBUG dumping:", k, file=sys.stderr)
-        #     save_dot(termfsts[k], self.stoi, "tmp/termfst_"+k+".dot")
-        #     termfsts[k].write("tmp/termfst_"+k+".fst")
-            
+        #parts are keyed by the symbol table and the rules they depend
+        #on: an edit only rebuilds the POS FSTs reaching the edited
+        #rules (adding new symbols rebuilds everything)
+        symkey = part_key(sorted(self.itos.items()))
+        deps = grammar_deps(dcg)
         self.fsts = {}
-        ###Expand/make non-terminal FSTs for each POS category
+        self.simplefsts = {}
+        self.compilestats = []
+        jobs = []
         for pos in descr["pos"]:
-            print("Making/expanding non-terminal fst for POS:", pos, file=sys.stderr)
-            fstcoll = make_rtn(pos, dcg["nonterminals"], self.stoi, {})
-            # print("__init__(): fstcoll: {}".format(fstcoll.keys()), file=sys.stderr)
-            # for sym in fstcoll:
-            #     #DEBUG DUMP FST
-            #     save_dot(fstcoll[sym], self.stoi, "tmp/"+pos+"_orig_"+sym+".dot")
-            #     fstcoll[sym].write("tmp/"+pos+"_orig_"+sym+".fst")
-
-            #replace non-terminals
-            replace_pairs = [(self.stoi[pos], fstcoll.pop(pos))]
-            for k, v in fstcoll.iteritems():
-                replace_pairs.append((self.stoi[k], v))
-            fst = wfst.replace(replace_pairs, call_arc_labeling="both")
-            fst.rmepsilon()
-            fst = wfst.determinize(fst)
-            fst.minimize()
-            # #DEBUG DUMP FST
-            # save_dot(fst, self.stoi, "tmp/"+pos+"_expanded.dot")
-            # fst.write("tmp/"+pos+"_expanded.fst")
-            # if True: #DEBUGGING
-            #     fst2 = fst.copy()
-            #     #rename symbols (simplify) 
-            #     if pos in descr["renamesyms"] and descr["renamesyms"][pos]:
-            #         labpairs = map(lambda x: (self.stoi[x[0]], self.stoi[x[1]]), descr["renamesyms"][pos])
-            #         fst2.relabel_pairs(opairs=labpairs, ipairs=labpairs)
-            #     fst2.rmepsilon()
-            #     fst2 = wfst.determinize(fst2)
-            #     fst2.minimize()            
-            #     #DEBUG DUMP FST
-            #     save_dot(fst2, self.stoi, "tmp/"+pos+"_expandedsimple.dot")
-            #     fst2.write("tmp/"+pos+"_expandedsimple.fst")            
-
-            #replace terminals
-            replace_pairs = [(self.stoi[pos], fst)]
-            for k, v in termfsts.iteritems():
-                replace_pairs.append((self.stoi[k], v))
-            fst = wfst.replace(replace_pairs, call_arc_labeling="both")
-            fst.rmepsilon()
-            fst = wfst.determinize(fst)
-            fst.minimize()
-            # #DEBUG DUMP FST
-            # save_dot(fst, self.stoi, "tmp/"+pos+"_expanded2.dot")
-            # fst.write("tmp/"+pos+"_expanded2.fst")
-
-            #rename symbols (simplify) JUST FOR DEBUGGING
-            if pos in descr["renamesyms"] and descr["renamesyms"][pos]:
-                labpairs = map(lambda x: (self.stoi[x[0]], self.stoi[x[1]]), descr["renamesyms"][pos])
-                fst.relabel_pairs(opairs=labpairs, ipairs=labpairs)
-            fst.rmepsilon()
-            fst = wfst.determinize(fst)
-            fst.minimize()            
-            # #DEBUG DUMP FST
-            # save_dot(fst, self.stoi, "tmp/"+pos+"_prefinal.dot")
-            # fst.write("tmp/"+pos+"_prefinal.fst")
-
-            #Convert into transducer:
-            #split I/O symbols by convention here: input symbols are single characters:
-            #Input syms (relabel outputs to EPS):
-            syms = [k for k in self.stoi if len(k) == 1]
-            labpairs = map(lambda x: (self.stoi[x], self.stoi[EPS]), syms)
-            fst.relabel_pairs(opairs=labpairs)
-            #Output syms (relabel inputs to EPS):
-            syms = [k for k in self.stoi if len(k) != 1]
-            labpairs = map(lambda x: (self.stoi[x], self.stoi[EPS]), syms)
-            fst.relabel_pairs(ipairs=labpairs)
-            # #DEBUG DUMP FST
-            # save_dot(fst, self.stoi, "tmp/"+pos+"_final.dot")
-            # fst.write("tmp/"+pos+"_final.fst")
+            reach = reachable(pos, deps)
+            nonterms = sorted(s for s in reach if s in dcg["nonterminals"])
+            terms = sorted(reach.difference(nonterms))
+            rtnkey = part_key("rtn", symkey, pos, [(s, dcg["nonterminals"][s]) for s in nonterms])
+            poskey = part_key("pos", symkey, rtnkey, [(s, dcg["terminals"].get(s)) for s in terms],
+                              descr["graphs"], descr["renamesyms"].get(pos), self.fsttype)
+            simplekey = part_key("simple", poskey)
+            fst = self.partcache.get(poskey)
+            simplefst = self.partcache.get(simplekey)
+            if fst is not None and simplefst is not None:
+                print("Reusing compiled fst for POS:", pos, file=sys.stderr)
+                self.fsts[pos] = fst
+                self.simplefsts[pos] = simplefst
+            else:
+                jobs.append((pos, terms, self.partcache.get(rtnkey), (rtnkey, poskey, simplekey)))
+        if not jobs:
+            return
+
+        ###Expand/make non-terminal FSTs for each POS category
+        if self.compilejobs > 1 and len(jobs) > 1:
+            #FSTs are passed to and from the workers serialised
+            pool = multiprocessing.Pool(min(self.compilejobs, len(jobs)), initializer=_init_compile_worker,
+                                        initargs=(dcg, descr, self.stoi, self.fsttype, True))
+            results = pool.map(_compile_pos_job, [(pos, terms, None if rtnfst is None else fst_to_bytes(rtnfst))
+                                                  for pos, terms, rtnfst, keys in jobs])
+            pool.close()
+            pool.join()
+            results = [(fst_from_bytes(rtnfst), fst_from_bytes(fst), fst_from_bytes(simplefst), stats)
+                       for rtnfst, fst, simplefst, stats in results]
+        else:
+            _init_compile_worker(dcg, descr, self.stoi, self.fsttype, False)
+            results = [_compile_pos_job((pos, terms, rtnfst)) for pos, terms, rtnfst, keys in jobs]
+        for (pos, terms, cachedrtnfst, (rtnkey, poskey, simplekey)), (rtnfst, fst, simplefst, stats) in zip(jobs, results):
             self.fsts[pos] = fst
+            self.simplefsts[pos] = simplefst
+            if cachedrtnfst is None:
+                self.partcache.put(rtnkey, rtnfst)
+            self.partcache.put(poskey, fst)
+            self.partcache.put(simplekey, simplefst)
+            self.compilestats.extend(stats)
 
     def __getstate__(self):
-        fsts = {}
-        for pos in self.fsts:
-            try:
-                fd, path = tempfile.mkstemp()
-                self.fsts[pos].write(path)
-                with open(path, "rb") as infh:
-                    serialisedfst = infh.read()
-            finally:
-                os.close(fd)
-                os.remove(path)
-            fsts[pos] = serialisedfst
-        d = self.__dict__
-        d["fsts"] = fsts
+        d = dict(self.__dict__)
+        d["fsts"] = dict((pos, fst_to_bytes(fst)) for pos, fst in self.fsts.iteritems())
+        d["simplefsts"] = dict((pos, fst_to_bytes(fst)) for pos, fst in self.simplefsts.iteritems())
+        #rebuilt from the POS FSTs
+        d.pop("unionfst", None)
+        d.pop("unionitos", None)
+        d.pop("simpleunionfst", None)
+        d.pop("markedfsts", None)
         return d
 
     def __setstate__(self, d):
-        fsts = {}
-        fsts = d.pop("fsts")
-        for pos in fsts:
-            try:
-                fd, path = tempfile.mkstemp()
-                with open(path, "wb") as outfh:
-                    outfh.write(fsts[pos])
-                fst = wfst.Fst.read(path)
-            finally:
-                os.close(fd)
-                os.remove(path)
-            fsts[pos] = fst
-        d["fsts"] = fsts
+        d = dict(d)
+        d["fsts"] = dict((pos, fst_from_bytes(fst)) for pos, fst in d["fsts"].iteritems())
+        d["simplefsts"] = dict((pos, fst_from_bytes(fst)) for pos, fst in d["simplefsts"].iteritems())
         self.__dict__ = d
+        self.markedfsts = {}
+        if self.unified:
+            self._make_union()
 
-    def parse(self, word, pos=None):
+    def parse(self, word, pos=None, max_parses=None):
+        """If _max_parses_ is given, path enumeration stops once that
+           many parses have been found (see Morphparse.parse())
+        """
+        if not pos and self.unified:
+            return self._parse_unified(word, max_parses)
         if pos:
             posl = [pos]
         else:
             posl = list(self.fsts.keys())
-        parses = set()
+        #parses of each POS start with "<pos>" so that (in this order)
+        #they follow those of the previous POS in sorted order
+        posl.sort(key=lambda pos: "<{}>".format(pos))
+        ifst = make_input(word, self.stoi)
+        parses = set() if max_parses is None else []
         for pos in posl:
+            if max_parses is not None and len(parses) >= max_parses:
+                break
             #print("parse(): trying POS:", pos, file=sys.stderr)
-            ifst = make_input(word, self.stoi)
             ofst = wfst.compose(ifst, self.fsts[pos])
             ofstnstates = len(list(ofst.states()))
             if not ofstnstates:
@@ -314,31 +715,289 @@ class Morphparse_DCG(Morphparse):
                 continue
             #print("parse(): parse successful for POS:", pos, file=sys.stderr)
             #save_dot(ofst, self.stoi, "tmp/output.dot")
-            paths = []
-            dfs_walk(ofst, self.itos, ofst.start(), None, [], paths)
-            for path in paths:
+            prefix = "<{}>".format(pos)
+            if max_parses is not None:
+                parses.extend(first_parses([(prefix, (ofst, ofst.start()))], lambda node: arc_outputs(node[0], node[1], self.itos), max_parses - len(parses)))
+                continue
+            for path in iter_paths(ofst, self.itos):
                 #print(" ".join([e[1] for e in path if e[1]]).encode("utf-8"))
-                parses.add("<{}>".format(pos) + path2parse(path))
+                parses.add(prefix + path2parse(path))
         parses = [simpbounds(p, self.bounds) for p in sorted(parses)]
         return parses
 
-    def parse_simple(self, word, pos=None):
-        re_ins = re.compile("|".join(["<noun>", "<verb>", "<adj>", "<adv>", "<st>"]))
-        re_outs = re.compile("|".join(["<cop>", "<loc>", "<pos>", "<prep>", "<pron>", "<ques>", "<rel>", "<pf>", "<sf>"]))
-        parses = self.parse(word, pos=pos)
-        for i, p in enumerate(parses):
-            p = re_ins.sub("{", p)
-            p = re_outs.sub("}", p)
-            p = p.replace("{}", "")
-            p = re.sub("^}", "", p)
-            for m in reversed(list(re.finditer("{", p))[1:]):
-                p = p[:m.start()] + p[m.end():]
-            if "{" in p and not "}" in p:
-                p = p + "}"
-            if "}" in p and not "{" in p:
-                p = p.replace("}", "")
-            parses[i] = p
-        return list(sorted(set(parses)))
+    def _parse_unified(self, word, max_parses=None):
+        """As parse() for all POS but with a single composition: the POS
+           marker on each path is output as "<pos>"
+        """
+        ifst = make_input(word, self.stoi)
+        ofst = wfst.compose(ifst, self.unionfst)
+        if not ofst.num_states():
+            return []
+        if max_parses is not None:
+            parses = first_parses([("", (ofst, ofst.start()))], lambda node: arc_outputs(node[0], node[1], self.unionitos), max_parses)
+        else:
+            parses = set(path2parse(path) for path in iter_paths(ofst, self.unionitos))
+        parses = [simpbounds(p, self.bounds) for p in sorted(parses)]
+        return parses
+
+    def parse_batch(self, words, pos=None):
+        """As parse() for each of _words_ (returns a list of parse
+           lists) but with a single composition per POS (or the union):
+           the words are combined in a prefix tree so that shared
+           prefixes are matched once
+        """
+        words = list(words)
+        uniqwords = sorted(set(words))
+        if not uniqwords:
+            return []
+        if pos:
+            posl = [pos]
+        elif self.unified:
+            posl = [None]
+        else:
+            posl = sorted(self.fsts)
+        gfsts = [(p, self._markedfst(p, len(uniqwords))) for p in posl]
+        ifst = make_inputtrie(uniqwords, self.stoi, self.markerbase)
+        parses = dict((word, set()) for word in uniqwords)
+        for p, gfst in gfsts:
+            ofst = wfst.compose(ifst, gfst)
+            if not ofst.num_states():
+                continue
+            itos = dict(self.itos if p is not None else self.unionitos)
+            for i, word in enumerate(uniqwords):
+                itos[self.markerbase + i] = word
+            prefix = "" if p is None else "<{}>".format(p)
+            for path in iter_paths(ofst, itos):
+                #the last arc carries the word marker
+                parses[path[-1][0]].add(prefix + path2parse(path[:-1]))
+        parses = dict((word, [simpbounds(p, self.bounds) for p in sorted(parses[word])]) for word in parses)
+        return [list(parses[word]) for word in words]
+
+    def parse_simple(self, word, pos=None, max_parses=None):
+        parses = self.parse(word, pos=pos, max_parses=max_parses)
+        return list(sorted(set(simple_parse(p) for p in parses)))
+
+    def parse_simpleguess(self, word):
+        """The single simple parse minimising the open-class portion of
+           the word (the first of parse_simple() sorted by
+           simple_nonstemlen, descending) or None: only the cheapest
+           paths through the stem-weighted FSTs are enumerated
+        """
+        ifst = make_input(word, self.stoi)
+        if self.unified:
+            ofsts = [("", wfst.compose(ifst, self.simpleunionfst), self.unionitos)]
+        else:
+            ofsts = [("<{}>".format(pos), wfst.compose(ifst, self.simplefsts[pos]), self.itos) for pos in sorted(self.simplefsts)]
+        results = []
+        for prefix, ofst, itos in ofsts:
+            if not ofst.num_states():
+                continue
+            dists = [float(w) for w in wfst.shortestdistance(ofst, reverse=True)]
+            results.append((dists[ofst.start()], prefix, ofst, itos, dists))
+        if not results:
+            return None
+        bestcost = min(result[0] for result in results)
+        parses = set()
+        for cost, prefix, ofst, itos, dists in results:
+            if cost == bestcost:
+                for path in iter_paths(ofst, itos, dists=dists):
+                    parses.add(simple_parse(simpbounds(prefix + path2parse(path), self.bounds)))
+        #ties resolved as for parse_simple()
+        parses = sorted(parses)
+        parses.sort(key=lambda x: simple_nonstemlen(x), reverse=True)
+        return parses[0]
+
+
+class Morphparse_RTN(Morphparse):
+    def __init__(self, dcg, descr):
+        """Keeps the grammar as a recursive transition network (an FST
+           per nonterminal and terminal symbol) which is expanded on the
+           fly while parsing: only the parts reachable with the input
+           word are visited. Parses are the same as with Morphparse_DCG
+           (which expands, determinises and minimises each POS grammar
+           up front), trading memory and compile time for work per word
+        """
+        othersyms = set()
+        for pos in descr["renamesyms"]:
+            othersyms.update([e[1] for e in descr["renamesyms"][pos]])
+        self.bounds = descr["bounds"]
+        self.itos, self.stoi = make_symmaps(dcg, descr["graphs"], othersyms)
+        self.posl = list(descr["pos"])
+        self.renames = dict((pos, dict(descr["renamesyms"].get(pos, []))) for pos in self.posl)
+        fstcoll = make_termfsts(dcg, descr["graphs"], self.stoi)
+        for pos in self.posl:
+            print("Making non-terminal fsts for POS:", pos, file=sys.stderr)
+            make_rtn(pos, dcg["nonterminals"], self.stoi, fstcoll)
+        #components as (start state, final states, character arcs
+        #(by character) and other arcs by state)
+        self.components = {}
+        for sym, fst in fstcoll.iteritems():
+            zero = wfst.Weight.Zero(fst.weight_type())
+            chararcs = dict((state, {}) for state in fst.states())
+            otherarcs = dict((state, []) for state in fst.states())
+            for state in fst.states():
+                for arc in fst.arcs(state):
+                    label = self.itos[arc.ilabel]
+                    if label in fstcoll or label == EPS:
+                        otherarcs[state].append((label, arc.nextstate))
+                    else:
+                        chararcs[state].setdefault(label, []).append(arc.nextstate)
+            finals = set(state for state in fst.states() if fst.final(state) != zero)
+            self.components[sym] = (fst.start(), finals, chararcs, otherarcs)
+        self.first = self._first_chars()
+
+    def _first_chars(self):
+        """Characters starting derivations of each component (None if
+           the component derives the empty string), to avoid calls
+           which cannot match the input
+        """
+        first = dict((sym, set()) for sym in self.components)
+        nullable = set()
+        changed = True
+        while changed:
+            changed = False
+            for sym, (start, finals, chararcs, otherarcs) in self.components.iteritems():
+                chars = set()
+                seen = set()
+                stack = [start]
+                while stack:
+                    state = stack.pop()
+                    if state in seen:
+                        continue
+                    seen.add(state)
+                    if state in finals and sym not in nullable:
+                        nullable.add(sym)
+                        changed = True
+                    chars.update(chararcs[state])
+                    for label, nextstate in otherarcs[state]:
+                        if label != EPS:
+                            chars.update(first[label])
+                        if label == EPS or label in nullable:
+                            stack.append(nextstate)
+                if chars != first[sym]:
+                    first[sym] = chars
+                    changed = True
+        return dict((sym, None if sym in nullable else chars) for sym, chars in first.iteritems())
+
+    def size(self):
+        """Number of states and arcs in the network"""
+        nstates = 0
+        narcs = 0
+        for start, finals, chararcs, otherarcs in self.components.values():
+            nstates += len(chararcs)
+            narcs += sum(len(v) for a in chararcs.values() for v in a.values())
+            narcs += sum(len(a) for a in otherarcs.values())
+        return nstates, narcs
+
+    def _derive(self, sym, word, i, chart):
+        """Set of (labels, j) for each derivation of word[i:j] from the
+           component _sym_, labels are the symbols (before renaming) and
+           characters along the path
+        """
+        if (sym, i) in chart:
+            return chart[(sym, i)]
+        start, finals, chararcs, otherarcs = self.components[sym]
+        derivations = set()
+        stack = [(start, i, ())]
+        while stack:
+            state, j, labels = stack.pop()
+            if state in finals:
+                derivations.add((labels, j))
+            c = word[j] if j < len(word) else None
+            for nextstate in chararcs[state].get(c, []):
+                stack.append((nextstate, j + 1, labels + (c,)))
+            for label, nextstate in otherarcs[state]:
+                if label == EPS:
+                    stack.append((nextstate, j, labels))
+                    continue
+                first = self.first[label]
+                if first is not None and c not in first:
+                    continue
+                #call: the symbol followed by a derivation of the
+                #component
+                for sublabels, k in self._derive(label, word, j, chart):
+                    stack.append((nextstate, k, labels + (label,) + sublabels))
+        chart[(sym, i)] = derivations
+        return derivations
+
+    def _continuations(self, word, chart, pos, state, j):
+        """Continuations of a parse at _state_ of the component _pos_
+           (see first_parses()): the arcs are followed as in _derive()
+           with derivations of called components from _chart_
+        """
+        start, finals, chararcs, otherarcs = self.components[pos]
+        renames = self.renames[pos]
+        if state in finals and j == len(word):
+            yield "", None
+        c = word[j] if j < len(word) else None
+        for nextstate in chararcs[state].get(c, []):
+            yield rtn_output((c,), renames), (pos, nextstate, j + 1)
+        for label, nextstate in otherarcs[state]:
+            if label == EPS:
+                yield "", (pos, nextstate, j)
+                continue
+            first = self.first[label]
+            if first is not None and c not in first:
+                continue
+            for sublabels, k in self._derive(label, word, j, chart):
+                yield rtn_output((label,) + sublabels, renames), (pos, nextstate, k)
+
+    def parse(self, word, pos=None, max_parses=None):
+        """If _max_parses_ is given, only the derivations of the POS
+           components needed for the first _max_parses_ parses are
+           enumerated (see Morphparse.parse())
+        """
+        if pos:
+            posl = [pos]
+        else:
+            posl = self.posl
+        #derivations of components are shared between POS, symbols are
+        #renamed per POS when output
+        chart = {}
+        if max_parses is not None:
+            starts = [("<{}>".format(pos), (pos, self.components[pos][0], 0)) for pos in posl]
+            parses = first_parses(starts, lambda node: self._continuations(word, chart, *node), max_parses)
+        else:
+            parses = set()
+            for pos in posl:
+                for labels, j in self._derive(pos, word, 0, chart):
+                    if j == len(word):
+                        parses.add("<{}>".format(pos) + rtn_output(labels, self.renames[pos]))
+        parses = [simpbounds(p, self.bounds) for p in sorted(parses)]
+        return parses
+
+    def parse_batch(self, words, pos=None):
+        return [self.parse(word, pos=pos) for word in words]
+
+    def parse_simple(self, word, pos=None, max_parses=None):
+        parses = self.parse(word, pos=pos, max_parses=max_parses)
+        return list(sorted(set(simple_parse(p) for p in parses)))
+
+    def parse_simpleguess(self, word):
+        parses = self.parse_simple(word)
+        if not parses:
+            return None
+        parses.sort(key=lambda x: simple_nonstemlen(x), reverse=True)
+        return parses[0]
+
+
+RE_INS = re.compile("|".join(["<noun>", "<verb>", "<adj>", "<adv>", "<st>"]))
+RE_OUTS = re.compile("|".join(["<cop>", "<loc>", "<pos>", "<prep>", "<pron>", "<ques>", "<rel>", "<pf>", "<sf>"]))
+def simple_parse(p):
+    """Reduce a parse to the word with its open-class portion marked by
+       braces
+    """
+    p = RE_INS.sub("{", p)
+    p = RE_OUTS.sub("}", p)
+    p = p.replace("{}", "")
+    p = re.sub("^}", "", p)
+    for m in reversed(list(re.finditer("{", p))[1:]):
+        p = p[:m.start()] + p[m.end():]
+    if "{" in p and not "}" in p:
+        p = p + "}"
+    if "}" in p and not "{" in p:
+        p = p.replace("}", "")
+    return p
             
 
 def simpbounds(parse, bounds):
@@ -356,17 +1015,80 @@ def path2parse(path):
             parse.append(i)
     return "".join(parse)
     
+def iter_paths(fst, itos, state=None, dists=None):
+    """Lazily yield the paths (lists of (input, output) symbols) from
+       _state_ (default: the start state) to final states of the
+       acyclic _fst_ in depth-first order: iterative, with the current
+       path prefix shared between branches
+
+       If _dists_ (shortest distances to the final states) is given,
+       only the cheapest paths are followed
+    """
+    if state is None:
+        state = fst.start()
+    zero = wfst.Weight.Zero(fst.weight_type())
+    path = []
+    #(state, length of path before the arc into state, arc labels)
+    stack = [(state, 0, None)]
+    while stack:
+        state, pathlen, labels = stack.pop()
+        del path[pathlen:]
+        if labels is not None:
+            path.append(labels)
+        if fst.final(state) != zero: #state is final?
+            if dists is None or float(fst.final(state)) == dists[state]:
+                yield list(path)
+        for arc in reversed(list(fst.arcs(state))):
+            if dists is None or float(arc.weight) + dists[arc.nextstate] == dists[state]:
+                stack.append((arc.nextstate, len(path), (itos[arc.ilabel], itos[arc.olabel])))
+
+def rtn_output(labels, renames):
+    """Parse output for _labels_ of a derivation in Morphparse_RTN:
+       symbols are renamed and enclosed in <>
+    """
+    labels = [renames.get(l, l) for l in labels]
+    return "".join(l if len(l) == 1 else "<{}>".format(l) for l in labels if l != EPS)
+
+def arc_outputs(fst, state, itos):
+    """Continuations of a parse at _state_ of the acyclic _fst_ (see
+       first_parses()): (output, (fst, nextstate)) for each arc, with
+       output as in path2parse(), and ("", None) if _state_ is final
+    """
+    zero = wfst.Weight.Zero(fst.weight_type())
+    if fst.final(state) != zero:
+        yield "", None
+    for arc in fst.arcs(state):
+        yield path2parse([(itos[arc.ilabel], itos[arc.olabel])]), (fst, arc.nextstate)
+
+def first_parses(starts, expand, max_parses):
+    """The first _max_parses_ distinct parses in sorted order (the order
+       of Morphparse.parse()) without enumerating the rest: _starts_ are
+       (output, node) pairs and _expand(node)_ yields (output, node)
+       continuations, node None ending a parse. The search is best-first
+       on the output so far and, as continuations of an output sort
+       after it, parses are completed in sorted order
+    """
+    counter = itertools.count() #ties are not resolved on nodes
+    heap = [(output, next(counter), node) for output, node in starts]
+    heapq.heapify(heap)
+    parses = []
+    while heap and len(parses) < max_parses:
+        output, _, node = heapq.heappop(heap)
+        if node is None:
+            if not parses or parses[-1] != output:
+                parses.append(output)
+            continue
+        for nextoutput, nextnode in expand(node):
+            heapq.heappush(heap, (output + nextoutput, next(counter), nextnode))
+    return parses
+
 def dfs_walk(fst, itos, state, labels, path, fullpaths):
-    #print(len(fullpaths), state, file=sys.stderr)
-    path = path[:]
+    """Append all paths from _state_ to _fullpaths_ (see iter_paths)
+    """
     if labels:
-        path.append(labels)
-    if fst.final(state) != wfst.Weight.Zero(fst.weight_type()): #state is final?
-        fullpaths.append(path)
-    #print(state, len(list(fst.arcs(state))), file=sys.stderr)
-    for arc in fst.arcs(state):
-        labs = (itos[arc.ilabel], itos[arc.olabel])
-        dfs_walk(fst, itos, arc.nextstate, labs, path, fullpaths)
+        path = path + [labels]
+    for p in iter_paths(fst, itos, state):
+        fullpaths.append(path + p)
         
 
 RE_STEM = re.compile("{.+?}")
@@ -375,11 +1097,19 @@ def simple_nonstemlen(simpleparse):
 
         
 if __name__ == "__main__":
-    import sys, codecs, argparse, pickle, json
+    import sys, codecs, argparse, pickle, json, itertools
     parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('descrfn', metavar='DESCRFN', type=str, help="JSON file containing a description of how to interpret the DCG file (e.g. graphemes and POS categories etc.)")
     parser.add_argument('dcgfn', metavar='DCGFN', type=str, help="input DCG filename")
     parser.add_argument('--simpleguess', action='store_true', help="output only a single parse analogous to 'stemming' rather than a full morphological information and all possibilities")
+    parser.add_argument('--maxparses', metavar='MAXPARSES', type=int, default=None, help="Output only the first MAXPARSES parses of a word (in sorted order), stopping the enumeration there")
+    parser.add_argument('--unified', action='store_true', help="Parse with a single transducer for all POS categories (one composition per word)")
+    parser.add_argument('--batchsize', metavar='BATCHSIZE', type=int, default=None, help="Parse words in batches of this size with one composition per transducer (--maxparses is not applied)")
+    parser.add_argument('--compilejobs', metavar='COMPILEJOBS', type=int, default=1, help="Number of processes compiling the POS FSTs in parallel")
+    parser.add_argument('--compilestats', action='store_true', help="Print the time taken and the FST size after each compilation stage (tab-separated on STDERR)")
+    parser.add_argument('--lazy', action='store_true', help="Expand the grammar on the fly for each word instead of compiling each POS transducer (less memory, slower parsing)")
+    parser.add_argument('--fsttype', metavar='FSTTYPE', type=str, default=DEF_FSTTYPE, help="Type of the compiled (immutable, arc-sorted) POS FSTs: 'const' or 'compact_unweighted' (if supported by the OpenFST build)")
+    parser.add_argument('--cachedir', metavar='CACHEDIR', type=str, default=None, help="Directory in which compiled FSTs are cached (keyed by a hash of the DCG and description)")
     args = parser.parse_args()
     
     with codecs.open(args.descrfn, encoding="utf-8") as infh:
@@ -387,14 +1117,28 @@ if __name__ == "__main__":
     with codecs.open(args.dcgfn, encoding="utf-8") as infh:
         dcg = load_simpledcg(infh.read())
 
-    morphparse = Morphparse_DCG(dcg, descr)
+    if args.lazy:
+        morphparse = Morphparse_RTN(dcg, descr)
+    else:
+        morphparse = Morphparse_DCG(dcg, descr, cachedir=args.cachedir, unified=args.unified, compilejobs=args.compilejobs, fsttype=args.fsttype)
+    if args.compilestats and not args.lazy:
+        print("\t".join(["pos", "phase", "stage", "seconds", "states", "arcs"]), file=sys.stderr)
+        for stat in morphparse.compilestats:
+            print("\t".join(["{:.4f}".format(e) if isinstance(e, float) else "{}".format(e) for e in stat]), file=sys.stderr)
 
-    for line in sys.stdin:
-        word = unicode(line, encoding="utf-8").strip()
-        if args.simpleguess:
-            parses = morphparse.parse_simple(word)
-            parses.sort(key=lambda x: simple_nonstemlen(x), reverse=True)
-            parse = parses[0]
-            print("{}\t{}".format(word, parse).encode("utf-8"))
-        else:
-            print("{}\t{}".format(word, " ".join(morphparse(word))).encode("utf-8"))
+    if args.batchsize and not args.simpleguess:
+        words = (unicode(line, encoding="utf-8").strip() for line in sys.stdin)
+        while True:
+            batch = list(itertools.islice(words, args.batchsize))
+            if not batch:
+                break
+            for word, parses in zip(batch, morphparse.parse_batch(batch)):
+                print("{}\t{}".format(word, " ".join(parses)).encode("utf-8"))
+    else:
+        for line in sys.stdin:
+            word = unicode(line, encoding="utf-8").strip()
+            if args.simpleguess:
+                parse = morphparse.parse_simpleguess(word)
+                print("{}\t{}".format(word, parse).encode("utf-8"))
+            else:
+                print("{}\t{}".format(word, " ".join(morphparse.parse(word, max_parses=args.maxparses))).encode("utf-8"))
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Split unsegmented phone strings (e.g. the output of G2P rules)
+   into phones from a phoneme set using a longest-match trie.
+"""
+from __future__ import unicode_literals, division, print_function #Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+END = None #trie key marking the end of a phone
+
+
+class PhoneTokeniseError(ValueError):
+    pass
+
+
+def make_trie(seqs):
+    """Nested dicts keyed by symbol, the END key maps to the complete
+       sequence
+    """
+    trie = {}
+    for seq in seqs:
+        node = trie
+        for sym in seq:
+            node = node.setdefault(sym, {})
+        node[END] = seq
+    return trie
+
+
+class PhoneTokeniser(object):
+    """Greedy longest-match tokenisation in a single pass over the
+       string
+    """
+    def __init__(self, phones):
+        self.phones = set(phones)
+        assert "" not in self.phones
+        self.trie = make_trie(self.phones)
+
+    def longest_match(self, s, i=0):
+        """Return the longest phone starting at s[i] or None
+        """
+        node = self.trie
+        match = None
+        for j in range(i, len(s)):
+            node = node.get(s[j])
+            if node is None:
+                break
+            if END in node:
+                match = node[END]
+        return match
+
+    def tokenise(self, s):
+        phones = []
+        i = 0
+        while i < len(s):
+            phone = self.longest_match(s, i)
+            if phone is None:
+                raise PhoneTokeniseError("Cannot decode '{}' in '{}' (position {})".format(s[i:], s, i))
+            phones.append(phone)
+            i += len(phone)
+        return phones
+
+    def __call__(self, s):
+        return self.tokenise(s)
+
+
+if __name__ == "__main__":
+    import sys
+    import codecs
+    import json
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('phonesetfile', metavar='PHONESETFILE', type=str, help="File containing the phoneme set (json utf-8).")
+    args = parser.parse_args()
+
+    with codecs.open(args.phonesetfile, encoding="utf-8") as infh:
+        phoneset = json.load(infh)
+    phonetok = PhoneTokeniser(phoneset["phones"])
+    for line in sys.stdin:
+        line = unicode(line.strip(), encoding="utf-8")
+        try:
+            print(" ".join(phonetok(line)).encode("utf-8"))
+        except PhoneTokeniseError as e:
+            print("WARNING: {}".format(e.args[0]).encode("utf-8"), file=sys.stderr)
+            print("".encode("utf-8"))
@@ -12,8 +12,10 @@ __email__ = "dvn.demitasse@gmail.com"
 
 import sys
 import re
+import itertools
 
 from decomp_simple import SyllabDecompounder
+from wordstore import load_words
 
 def matching_suffix(word, syl, suffs):
     """Check orthography matching and final syl endswith phones (onsets
@@ -385,30 +387,37 @@ class LexStresser(object):
 
 
 class LexStresserDecomp(LexStresser):
-    def __init__(self, phonemeset, wordlist):
+    """_nbest_ > 1: if the syllables cannot be divided among the parts
+       of the best segmentation, try up to _nbest_ segmentations
+    """
+    def __init__(self, phonemeset, wordlist, nbest=1):
         LexStresser.__init__(self, phonemeset)
         self.decomp = SyllabDecompounder(wordlist)
+        self.nbest = nbest
 
     def _decomp(self, word, syls):
-        wordparts = self.decomp(word)
-        #print("wordparts:", wordparts, file=sys.stderr)
-        if len(wordparts) > 1:
-            #Now determine expected number of syllables in each wordpart
-            #so as to split up syllables accordingly and feed to the
-            #simple stress assigner
-            nvowels = map(len, map(self.graphvowelsre.findall, wordparts))
-            #print(nvowels, file=sys.stderr)
-            if len(syls) != sum(nvowels) or 0 in nvowels:
-                print("_decomp(): nsyls and ngraphvowels missmatch for {} ({})".format(word, wordparts).encode("utf-8"), file=sys.stderr)
+        bestparts = None
+        for cost, wordparts in itertools.islice(self.decomp.nbest(word), self.nbest):
+            #print("wordparts:", wordparts, file=sys.stderr)
+            if len(wordparts) > 1:
+                #Now determine expected number of syllables in each wordpart
+                #so as to split up syllables accordingly and feed to the
+                #simple stress assigner
+                nvowels = map(len, map(self.graphvowelsre.findall, wordparts))
+                #print(nvowels, file=sys.stderr)
+                if len(syls) != sum(nvowels) or 0 in nvowels:
+                    bestparts = bestparts or wordparts
+                    continue
+                parts = []
+                i = 0
+                for w, nv in zip(wordparts, nvowels):
+                    parts.append((w, syls[i:i+nv]))
+                    i += nv
+                return parts
+            else:
                 return [(word, syls)]
-            parts = []
-            i = 0
-            for w, nv in zip(wordparts, nvowels):
-                parts.append((w, syls[i:i+nv]))
-                i += nv
-            return parts
-        else:
-            return [(word, syls)]
+        print("_decomp(): nsyls and ngraphvowels missmatch for {} ({})".format(word, bestparts).encode("utf-8"), file=sys.stderr)
+        return [(word, syls)]
         
     def get_stress_word(self, word, syls):
         parts = self._decomp(word, syls)
@@ -431,7 +440,8 @@ if __name__ == "__main__":
     
     parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('phonesetfile', metavar='PHONESETFILE', type=str, help="File containing the phoneme set (json utf-8).")
-    parser.add_argument('--decomp', metavar='WORDLIST', type=str, default=None, help="Apply decompounding before stress assignment (requires a word list)")
+    parser.add_argument('--decomp', metavar='WORDLIST', type=str, default=None, help="Apply decompounding before stress assignment (requires a word list or a word store built with 'wordstore.py')")
+    parser.add_argument('--decompnbest', metavar='N', type=int, default=1, help="Number of decompounder segmentations to try when the syllables do not match the parts of the best one")
     parser.add_argument('--oformat', metavar='OUTPUTFORMAT', default=dictconv.DEF_OUTFORMAT, help="output format (flat|nested)")
     parser.add_argument('--defstresstone', metavar='DEFSTRESSTONE', default=dictconv.DEFSTRESSTONE, help="default stress/tone")
     args = parser.parse_args()
@@ -443,9 +453,8 @@ if __name__ == "__main__":
         lexstress = LexStresser(phoneset)
         #print(lexstress)
     else:
-        with codecs.open(args.decomp, encoding="utf-8") as infh:
-            wordlist = infh.read().split()
-        lexstress = LexStresserDecomp(phoneset, wordlist)
+        wordlist = load_words(args.decomp)
+        lexstress = LexStresserDecomp(phoneset, wordlist, nbest=args.decompnbest)
         #print(lexstress)
 
     for line in sys.stdin:
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Build a compact, memory-mapped word list store from a text word
+   list (whitespace-separated words on STDIN, store filename as
+   argument). Supports membership and prefix/suffix queries (as used
+   by the decompounder) without loading every word at start-up.
+
+   The store contains two minimised acyclic automata: one accepting
+   the words and one accepting the reversed words. File layout
+   (little-endian uint32s): MAGIC, number of words, size of the
+   forward automaton, root offsets of the forward and reversed
+   automata, followed by the nodes of both automata. Each node is a
+   header ((number of arcs << 1) | final), the arc labels (unicode
+   code points, sorted) and the offsets of the arc target nodes
+   (relative to the start of the automaton).
+"""
+from __future__ import unicode_literals, division, print_function #Py2
+
+__author__ = "Daniel van Niekerk"
+__email__ = "dvn.demitasse@gmail.com"
+
+import mmap
+import struct
+import codecs
+from bisect import bisect_left
+
+MAGIC = b"ZAWORDS1\n"
+UINT = struct.Struct("<I")
+HEADER = struct.Struct("<4I")
+END = None
+
+
+def compile_automaton(words):
+    """Returns the packed nodes of the minimised automaton accepting
+       _words_ and the offset of its root node
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for c in word:
+            node = node.setdefault(c, {})
+        node[END] = True
+    data = bytearray()
+    register = {}
+    def pack(node):
+        arcs = sorted((ord(c), pack(child)) for c, child in node.items() if c is not END)
+        signature = (END in node, tuple(arcs))
+        if signature not in register:
+            register[signature] = len(data)
+            data.extend(struct.pack("<{}I".format(1 + 2 * len(arcs)),
+                                    len(arcs) << 1 | int(END in node),
+                                    *([label for label, _ in arcs] + [target for _, target in arcs])))
+        return register[signature]
+    root = pack(trie)
+    return bytes(data), root
+
+
+def write_wordstore(words, fn):
+    words = set(words)
+    fwd, fwdroot = compile_automaton(words)
+    bwd, bwdroot = compile_automaton(w[::-1] for w in words)
+    with open(fn, "wb") as outfh:
+        outfh.write(MAGIC)
+        outfh.write(HEADER.pack(len(words), len(fwd), fwdroot, bwdroot))
+        outfh.write(fwd)
+        outfh.write(bwd)
+
+
+def load_words(fn):
+    """Word store at _fn_ if it is one, else the words in the text file
+    """
+    with open(fn, "rb") as infh:
+        if infh.read(len(MAGIC)) == MAGIC:
+            return WordStore(fn)
+    with codecs.open(fn, encoding="utf-8") as infh:
+        return infh.read().split()
+
+
+class WordStore(object):
+    """Read-only word set backed by a memory-mapped store file, with
+       the same queries as decomp_simple.WordIndex
+    """
+    def __init__(self, fn):
+        self.fn = fn
+        self._open()
+
+    def _open(self):
+        with open(self.fn, "rb") as infh:
+            self.mm = mmap.mmap(infh.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not a word store file: {}".format(self.fn))
+        self.n, fwdsize, fwdroot, bwdroot = HEADER.unpack_from(self.mm, len(MAGIC))
+        fwdstart = len(MAGIC) + HEADER.size
+        #(automaton start, root node position) per automaton
+        self.fwd = (fwdstart, fwdstart + fwdroot)
+        self.bwd = (fwdstart + fwdsize, fwdstart + fwdsize + bwdroot)
+
+    def __getstate__(self):
+        return {"fn": self.fn}
+
+    def __setstate__(self, d):
+        self.__dict__ = d
+        self._open()
+
+    def __len__(self):
+        return self.n
+
+    def _node(self, pos):
+        """Returns (final, arc labels) of the node at _pos_"""
+        header = UINT.unpack_from(self.mm, pos)[0]
+        return header & 1, struct.unpack_from("<{}I".format(header >> 1), self.mm, pos + UINT.size)
+
+    def _target(self, automaton, pos, nlabels, k):
+        return automaton[0] + UINT.unpack_from(self.mm, pos + (1 + nlabels + k) * UINT.size)[0]
+
+    def _match_lengths(self, automaton, chars):
+        """Lengths _i_ for which chars[:i] is accepted by _automaton_"""
+        lengths = []
+        pos = automaton[1]
+        for i, c in enumerate(chars):
+            final, labels = self._node(pos)
+            if final:
+                lengths.append(i)
+            k = bisect_left(labels, ord(c))
+            if k == len(labels) or labels[k] != ord(c):
+                return lengths
+            pos = self._target(automaton, pos, len(labels), k)
+        if self._node(pos)[0]:
+            lengths.append(len(chars))
+        return lengths
+
+    def prefix_lengths(self, word, maxlen=None):
+        """Lengths _i_ (up to _maxlen_) for which word[:i] is in the
+           word list
+        """
+        return self._match_lengths(self.fwd, word[:maxlen])
+
+    def suffix_starts(self, word, maxlen=None):
+        """Positions _i_ for which word[i:] (up to _maxlen_ long) is in
+           the word list
+        """
+        return [len(word) - j for j in self._match_lengths(self.bwd, word[::-1][:maxlen])]
+
+    def split_matches(self, word, maxlen=None):
+        """(i, number of word[:i] and word[i:] in the word list) for the
+           positions 0 <= i < len(word) with at least one, parts longer
+           than _maxlen_ are not looked up
+        """
+        matches = dict.fromkeys(self.prefix_lengths(word, maxlen), 1)
+        for i in self.suffix_starts(word, maxlen):
+            matches[i] = matches.get(i, 0) + 1
+        return sorted((i, m) for i, m in matches.items() if i < len(word))
+
+    def __contains__(self, word):
+        lengths = self.prefix_lengths(word)
+        return bool(lengths) and lengths[-1] == len(word)
+
+    def __iter__(self):
+        """Words in (code point) sorted order"""
+        stack = [(self.fwd[1], "")]
+        while stack:
+            pos, prefix = stack.pop()
+            final, labels = self._node(pos)
+            if final:
+                yield prefix
+            for k in reversed(range(len(labels))):
+                stack.append((self._target(self.fwd, pos, len(labels), k), prefix + unichr(labels[k])))
+
+
+if __name__ == "__main__":
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('storefile', metavar='STOREFILE', type=str, help="Output word store file.")
+    args = parser.parse_args()
+
+    words = (unicode(w, encoding="utf-8") for line in sys.stdin for w in line.split())
+    write_wordstore(words, args.storefile)